@@ -0,0 +1,866 @@
+#!/usr/bin/env python3
+"""
+Offline micro-benchmarks for the vibe index and matcher.
+
+    python3 bench_vibe.py index-load --index moode_library_index.json
+    python3 bench_vibe.py match --index moode_library_index.json
+    python3 bench_vibe.py approx --index moode_library_index.json [--replay DIR]
+    python3 bench_vibe.py synth --sizes 10000,100000 [--binary] [--dir DIR]
+    python3 bench_vibe.py norm
+    python3 bench_vibe.py http
+
+Each result is one line of space-separated key=value pairs so runs can be
+diffed between releases.
+"""
+import argparse
+import io
+import json
+import os
+import random
+import re
+import resource
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from contextlib import redirect_stdout
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+import requests
+
+import lastfm_client
+from lastfm_client import DeadlineExceeded, LastfmClient
+from moode_index import BinaryIndex, binary_path_for, load_index, write_binary_index
+from moode_norm import TITLE_JUNK, norm
+
+
+def rss_kb() -> tuple:
+    """Return (current, peak) resident set size in KiB."""
+    try:
+        with open("/proc/self/status", "r", encoding="ascii") as f:
+            fields = dict(line.split(":", 1) for line in f if ":" in line)
+        return int(fields["VmRSS"].split()[0]), int(fields["VmHWM"].split()[0])
+    except (OSError, KeyError, ValueError):
+        # Not Linux: ru_maxrss only (KiB on Linux, bytes on macOS); it also
+        # survives execve, so deltas are best-effort here.
+        peak = int(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss)
+        return peak, peak
+
+
+def emit(name: str, **fields):
+    parts = [name] + [f"{k}={v}" for k, v in fields.items()]
+    print(" ".join(parts), flush=True)
+
+
+# -----------------------------
+# index-load: JSON parse vs binary mmap
+# -----------------------------
+
+def index_load_child(args):
+    with open(args.keys, "r", encoding="utf-8") as f:
+        keys = json.load(f)
+    rss0, _ = rss_kb()
+
+    t0 = time.perf_counter()
+    if args.format == "json":
+        with open(args.index, "r", encoding="utf-8") as f:
+            text_map = json.load(f).get("text_map", {})
+    else:
+        text_map = BinaryIndex(args.index).get("text_map")
+    load_s = time.perf_counter() - t0
+
+    t0 = time.perf_counter()
+    hits = 0
+    for k in keys:
+        if text_map.get(k):
+            hits += 1
+    lookup_s = time.perf_counter() - t0
+    rss1, peak = rss_kb()
+
+    print(json.dumps({
+        "load_ms": round(load_s * 1000, 2),
+        "lookup_us": round(lookup_s * 1e6 / max(1, len(keys)), 2),
+        "hits": hits,
+        "rss_kb": rss1 - rss0,
+        "peak_rss_kb": peak,
+    }))
+
+
+def index_load(args):
+    json_path = args.index
+    bin_path = binary_path_for(json_path)
+    with open(json_path, "r", encoding="utf-8") as f:
+        idx = json.load(f)
+    text_map = idx.get("text_map", {})
+    if args.rebuild_bin or not os.path.exists(bin_path):
+        write_binary_index(bin_path, {"text_map": text_map, "mbid_map": idx.get("mbid_map") or {}})
+
+    rng = random.Random(args.seed)
+    keys = list(text_map)
+    sample = [rng.choice(keys) for _ in range(args.lookups)] if keys else []
+    sample += [f"missing artist {i}|missing title" for i in range(args.lookups // 10)]
+    del idx, text_map, keys
+
+    with tempfile.NamedTemporaryFile("w", suffix=".json", delete=False) as kf:
+        json.dump(sample, kf)
+    try:
+        for fmt, path in (("json", json_path), ("bin", bin_path)):
+            runs = []
+            for _ in range(args.repeat):
+                res = subprocess.run(
+                    [sys.executable, __file__, "_index-load-child", "--format", fmt,
+                     "--index", path, "--keys", kf.name],
+                    check=True, capture_output=True, text=True,
+                )
+                runs.append(json.loads(res.stdout))
+            best = min(runs, key=lambda r: r["load_ms"])
+            emit("index-load", format=fmt, bytes=os.path.getsize(path), **best)
+    finally:
+        os.unlink(kf.name)
+
+
+# -----------------------------
+# norm: shared memoized norm() vs the original per-script copy
+# -----------------------------
+
+def norm_legacy(s: str) -> str:
+    """norm() as it was copy-pasted into both scripts before moode_norm."""
+    if not s:
+        return ""
+    s = s.casefold().strip()
+    s = re.sub(r"\s*\(.*?\)\s*", " ", s)
+    s = re.sub(r"\s*\[.*?\]\s*", " ", s)
+    s = re.sub(r"\b(feat|ft)\.?\b.*$", "", s)
+    for junk in TITLE_JUNK:
+        s = s.replace(junk, " ")
+    s = re.sub(r"[^a-z0-9]+", " ", s)
+    return re.sub(r"\s+", " ", s).strip()
+
+
+NORM_TOKENS = [
+    "love", "night", "blue", "olive", "monolith", "stereolab", "edith", "live",
+    "edit", "liv", "ed", "it", "remaster", "remastered", "eo", "mono", "stereo",
+    "album version", "single version", "radio edit", "bonus track",
+    "deluxe edition", "expanded edition", "live album version",
+    "(live)", "[remastered 2011]", "(feat. someone)", "feat.", "ft", "ft.",
+    "featuring", "Beyoncé", "Motörhead", "Straße", "ﬁre", "İstanbul", "Ⅻ",
+    "AC/DC", "guns n' roses", "p!nk", "2001", "(", ")", "[", "]", "&", "-", "'",
+]
+NORM_SEPS = ["", " ", " ", " ", "  ", "\t", " - ", "/", ".", "\n"]
+
+
+def norm_corpus(size: int, seed: int) -> list:
+    """Random strings built from junk fragments, brackets, feat markers and
+    non-ASCII; empty separators glue fragments into overlaps like "livedit"."""
+    rng = random.Random(seed)
+    out = ["", " ", "()", "[]"]
+    while len(out) < size:
+        n = rng.randint(1, 7)
+        parts = []
+        for _ in range(n):
+            tok = rng.choice(NORM_TOKENS)
+            parts.append(tok.upper() if rng.random() < 0.15 else tok)
+            parts.append(rng.choice(NORM_SEPS))
+        out.append("".join(parts))
+    return out
+
+
+def norm_bench(args):
+    corpus = norm_corpus(args.size, args.seed)
+    if args.index:
+        # Index keys are already normalized; norm() must be idempotent on them.
+        corpus += [part for k in load_index(args.index)["text_map"] for part in k.split("|", 1)]
+
+    norm.cache_clear()
+    mismatches = [s for s in corpus if norm(s) != norm_legacy(s)]
+    for s in mismatches[:10]:
+        print(f"MISMATCH {s!r}: legacy={norm_legacy(s)!r} shared={norm(s)!r}", file=sys.stderr)
+
+    # Realistic call pattern: a few hundred artist/album strings normalized
+    # over and over (track_key, album_key, genre_tokens, guards).
+    rng = random.Random(args.seed)
+    hot = corpus[:500]
+    repeated = [rng.choice(hot) for _ in range(args.size)]
+
+    def per_call_us(fn, items, clear=False):
+        if clear:
+            norm.cache_clear()
+        t0 = time.perf_counter()
+        for s in items:
+            fn(s)
+        return round((time.perf_counter() - t0) * 1e6 / max(1, len(items)), 3)
+
+    emit("norm", case="corpus", strings=len(corpus),
+         legacy_us=per_call_us(norm_legacy, corpus),
+         uncached_us=per_call_us(norm.__wrapped__, corpus),
+         shared_us=per_call_us(norm, corpus, clear=True),
+         mismatches=len(mismatches))
+    emit("norm", case="repeated", strings=len(repeated),
+         legacy_us=per_call_us(norm_legacy, repeated),
+         uncached_us=per_call_us(norm.__wrapped__, repeated),
+         shared_us=per_call_us(norm, repeated, clear=True),
+         mismatches=len(mismatches))
+    if mismatches:
+        raise SystemExit(1)
+
+
+# -----------------------------
+# match: per-hop fuzzy matching, linear text_map scan vs artist_map
+# -----------------------------
+
+def fuzzy_linear(text_map: dict, rec_artist: str, rec_title: str):
+    """The pre-artist_map fuzzy_within_artist: scans every text_map key."""
+    a = norm(rec_artist)
+    t = norm(rec_title)
+    if not a or not t:
+        return None
+    key = f"{a}|{t}"
+    if key in text_map:
+        return text_map[key]
+    t_words = t.split()
+    t_prefix = " ".join(t_words[:8]) if len(t_words) > 8 else t
+    candidates = []
+    prefix = a + "|"
+    for k, paths in text_map.items():
+        if not k.startswith(prefix):
+            continue
+        _, title_norm = k.split("|", 1)
+        if title_norm == t or title_norm.startswith(t_prefix) or t.startswith(title_norm):
+            candidates.extend(paths)
+    return candidates or None
+
+
+def make_hops(text_map: dict, hops: int, per_hop: int, seed: int) -> list:
+    """
+    Recommendation lists shaped like getSimilar results that miss the exact
+    key: longer titles (fuzzy hits), unknown titles by known artists, and
+    unknown artists.
+    """
+    rng = random.Random(seed)
+    keys = list(text_map)
+    out = []
+    for _ in range(hops):
+        recs = []
+        for i in range(per_hop):
+            a, _, t = rng.choice(keys).partition("|")
+            kind = i % 3
+            if kind == 0:
+                recs.append((a, f"{t} extended"))
+            elif kind == 1:
+                recs.append((a, f"no such title {rng.randrange(10**6)}"))
+            else:
+                recs.append((f"unknown artist {rng.randrange(10**6)}", t))
+        out.append(recs)
+    return out
+
+
+def match(args):
+    from lastfm_vibe_radio import fuzzy_within_artist
+
+    lib = load_index(args.index)
+    text_map, artist_map = lib["text_map"], lib["artist_map"]
+    hop_recs = make_hops(text_map, args.hops, args.per_hop, args.seed)
+
+    def same(x, y):
+        return sorted(x or ()) == sorted(y or ())
+
+    mismatches = sum(
+        0 if same(fuzzy_linear(text_map, a, t), fuzzy_within_artist(text_map, artist_map, a, t)) else 1
+        for a, t in hop_recs[0]
+    )
+
+    for name, fn in (
+        ("linear", lambda a, t: fuzzy_linear(text_map, a, t)),
+        ("artist_map", lambda a, t: fuzzy_within_artist(text_map, artist_map, a, t)),
+    ):
+        hits = 0
+        t0 = time.perf_counter()
+        for recs in hop_recs:
+            for a, t in recs:
+                if fn(a, t):
+                    hits += 1
+        elapsed = time.perf_counter() - t0
+        emit("match", impl=name, keys=len(text_map), hops=len(hop_recs), per_hop=args.per_hop,
+             hop_ms=round(elapsed * 1000 / max(1, len(hop_recs)), 3), hits=hits, mismatches=mismatches)
+
+
+# -----------------------------
+# approx: trigram matching hit rate and latency
+# -----------------------------
+
+def replayed_recs(path: str) -> list:
+    """(artist, title) of every recommendation in a --record directory."""
+    recs = []
+    for name in sorted(os.listdir(path)):
+        if not name.endswith(".json"):
+            continue
+        with open(os.path.join(path, name), "r", encoding="utf-8") as f:
+            for t in json.load(f).get("tracks") or []:
+                artist = t.get("artist", {})
+                artist = artist.get("name", "") if isinstance(artist, dict) else str(artist)
+                if t.get("name") and artist:
+                    recs.append((artist, t["name"]))
+    return recs
+
+
+def perturb(rng: random.Random, artist: str, title: str, other_artist: str):
+    """A spelling of (artist, title) that misses the exact key and the same-artist fuzzy match."""
+    kind = rng.randrange(4)
+    if kind == 0:
+        return "suffix", artist, title
+    if kind == 1:
+        return "collab", f"{other_artist} & {artist}", title
+    if kind == 2:
+        # norm() drops non-ASCII letters, so "Beyoncé" keys as "beyonc".
+        i = next((i for i, ch in enumerate(artist) if ch in "aeiou"), 0)
+        return "accent", artist[:i] + "áéíóú"["aeiou".find(artist[i:i + 1])] + artist[i + 1:], title
+    i = rng.randrange(max(1, len(title) - 1))
+    return "typo", artist, title[:i] + title[i + 1:i + 2] + title[i:i + 1] + title[i + 2:]
+
+
+def approx_bench(args):
+    from lastfm_vibe_radio import approx_matches, fuzzy_within_artist
+
+    lib = load_index(args.index)
+    text_map, artist_map, trigram_map = lib["text_map"], lib["artist_map"], lib["trigram_map"]
+    rng = random.Random(args.seed)
+    if args.replay:
+        recs = replayed_recs(args.replay)
+        source = "replay"
+    else:
+        recs = []
+        for key in rng.sample(list(text_map), min(args.recs, len(text_map))):
+            row = lib["tag_map"].get(sorted(text_map[key])[0]) if lib["tag_map"] else None
+            a, _, t = key.partition("|")
+            recs.append((row[0], row[1]) if row and row[0] and row[1] else (a, t))
+        source = "index"
+    artists = sorted({a for a, _ in recs}) or ["someone"]
+
+    # Each recommendation as given, plus one perturbed spelling of those that
+    # resolve exactly (truth = the exact key), plus decoys that should miss.
+    cases = []
+    for a, t in recs[:args.recs]:
+        key = f"{norm(a)}|{norm(t)}"
+        cases.append(("as-is", a, t, key if key in text_map else ""))
+        if key in text_map:
+            kind, pa, pt = perturb(rng, a, t, rng.choice(artists))
+            if kind == "suffix":
+                pa = f"{a} {rng.choice(['Knowles', 'Band', 'Trio', 'Orchestra'])}"
+            cases.append((kind, pa, pt, key))
+    for i in range(args.recs // 10):
+        cases.append(("decoy", f"nobody {rng.randrange(10**6)}", f"unheard song {rng.randrange(10**6)}", ""))
+
+    by_kind = {}
+    latencies = []
+    for kind, a, t, truth in cases:
+        st = by_kind.setdefault(kind, {"n": 0, "exact": 0, "fuzzy": 0, "approx": 0, "correct": 0, "wrong": 0, "miss": 0})
+        st["n"] += 1
+        if f"{norm(a)}|{norm(t)}" in text_map:
+            st["exact"] += 1
+            continue
+        if fuzzy_within_artist(text_map, artist_map, a, t):
+            st["fuzzy"] += 1
+            continue
+        t0 = time.perf_counter()
+        found = approx_matches(trigram_map, a, t, threshold=args.threshold)
+        latencies.append(time.perf_counter() - t0)
+        if found:
+            st["approx"] += 1
+            if found[0][0] == truth:
+                st["correct"] += 1
+            else:
+                st["wrong"] += 1
+        else:
+            st["miss"] += 1
+
+    latencies.sort()
+
+    def pct(p):
+        return round(latencies[min(len(latencies) - 1, int(p * len(latencies)))] * 1e6, 1) if latencies else 0
+
+    for kind, st in sorted(by_kind.items()):
+        resolved = st["exact"] + st["fuzzy"] + st["approx"]
+        emit("approx", source=source, kind=kind, keys=len(text_map), threshold=args.threshold, **st,
+             hit_rate=round(resolved / max(1, st["n"]), 3))
+    emit("approx-latency", calls=len(latencies), p50_us=pct(0.5), p95_us=pct(0.95), max_us=pct(1.0))
+
+
+# -----------------------------
+# synth: synthetic libraries of a given size, end to end
+# -----------------------------
+# A library is generated as MPD song dicts and run through the index
+# builder's own record/map code, so the index has the real layout. Artist
+# popularity and title words are Zipf-distributed, some titles carry
+# remaster/live/feat. suffixes or are covers, and a few files have a
+# " (1).flac" duplicate (PAREN_COPY_RE). getSimilar responses for a set of
+# popular tracks are written as a --replay directory, so a full vibe run
+# chains hops over them with no network and no MPD.
+
+SYLLABLES = (
+    "ka", "lo", "mi", "ra", "ven", "tor", "sil", "an", "bel", "cor", "da", "el", "fin", "gar",
+    "hol", "is", "jun", "kel", "lum", "mar", "nor", "os", "pel", "quin", "ros", "sa", "tel",
+    "ul", "var", "wen", "yor", "zel", "bri", "cha", "dre", "fa", "glo", "mo", "ne", "stu",
+)
+ACCENTED = {"a": "á", "e": "é", "i": "í", "o": "ö", "u": "ü"}
+TITLE_SUFFIXES = (" (Remastered)", " (Live)", " - 2011 Remaster", " (Radio Edit)", " (Acoustic Version)")
+GENRES = ("Rock", "Pop", "Jazz", "Electronic", "Folk", "Hip-Hop", "Classical", "Soul", "Metal",
+          "Blues", "Country", "Reggae")
+SYNTH_ROOTS = ("USB/SamsungMoode", "OSDISK", "NAS/Music")
+
+
+def synth_word(rng: random.Random, lo: int = 1, hi: int = 3) -> str:
+    return "".join(rng.choice(SYLLABLES) for _ in range(rng.randint(lo, hi))).capitalize()
+
+
+def synth_artist(rng: random.Random) -> str:
+    r = rng.random()
+    if r < 0.45:
+        name = f"{synth_word(rng)} {synth_word(rng, 2, 3)}"
+    elif r < 0.75:
+        name = f"The {synth_word(rng)} {synth_word(rng)}s"
+    elif r < 0.85:
+        name = f"{synth_word(rng)} & {synth_word(rng)}"
+    else:
+        name = synth_word(rng, 2, 4)
+    if rng.random() < 0.05:
+        i = next((i for i, ch in enumerate(name) if ch in ACCENTED), -1)
+        if i >= 0:
+            name = name[:i] + ACCENTED[name[i]] + name[i + 1:]
+    return name
+
+
+def zipf_cum(n: int, s: float = 1.05) -> list:
+    """Cumulative Zipf weights for random.choices(cum_weights=...)."""
+    cum, total = [], 0.0
+    for rank in range(1, n + 1):
+        total += 1.0 / rank ** s
+        cum.append(total)
+    return cum
+
+
+def synth_library(size: int, seed: int) -> list:
+    """About `size` MPD song dicts: albums of 8-14 tracks by Zipf-popular artists."""
+    rng = random.Random(seed)
+    artists = list(dict.fromkeys(synth_artist(rng) for _ in range(max(1, size // 12))))
+    artist_cum = zipf_cum(len(artists))
+    genre_of = {a: rng.choice(GENRES) for a in artists}
+    vocab = list(dict.fromkeys(synth_word(rng) for _ in range(6000)))
+    vocab_cum = zipf_cum(len(vocab))
+    songs = []
+    albums = set()
+    while len(songs) < size:
+        artist = rng.choices(artists, cum_weights=artist_cum)[0]
+        album = " ".join(rng.choices(vocab, cum_weights=vocab_cum, k=rng.randint(1, 3)))
+        while (artist, album) in albums:
+            album += " II"
+        albums.add((artist, album))
+        root = rng.choice(SYNTH_ROOTS)
+        for track in range(1, rng.randint(8, 14) + 1):
+            r = rng.random()
+            if r < 0.04 and songs:
+                title = rng.choice(songs)["title"]  # cover
+            else:
+                words = rng.choices(vocab, cum_weights=vocab_cum, k=rng.choice((1, 1, 2, 2, 2, 3, 3, 4, 5)))
+                title = " ".join([words[0]] + [w.lower() for w in words[1:]])
+                if r > 0.88:
+                    title += rng.choice(TITLE_SUFFIXES)
+                elif r > 0.85:
+                    title += f" (feat. {rng.choice(artists)})"
+            f = f"{root}/{artist}/{album}/{track:02d} {title}.flac"
+            song = {
+                "file": f, "artist": artist, "title": title, "album": album,
+                "genre": genre_of[artist], "duration": f"{rng.uniform(120, 420):.3f}",
+                "last-modified": "2024-01-01T00:00:00Z",
+            }
+            if rng.random() < 0.4:
+                song["musicbrainz_trackid"] = "%08x-%04x-%04x-%04x-%012x" % (
+                    rng.getrandbits(32), rng.getrandbits(16), rng.getrandbits(16),
+                    rng.getrandbits(16), rng.getrandbits(48))
+            songs.append(song)
+            if rng.random() < 0.03:
+                songs.append({**song, "file": f[:-len(".flac")] + " (1).flac"})
+    return songs[:size]
+
+
+def write_synth_index(path: str, size: int, seed: int) -> dict:
+    """Write a synthetic JSON index at `path`; returns the index dict and its stats."""
+    from build_moode_index import Progress, build_file_records, mbid_map_from_files, text_map_from_files, write_index
+    from lastfm_vibe_radio import PAREN_COPY_RE
+    from moode_index import build_artist_map, build_trigram_map
+
+    songs = synth_library(size, seed)
+    files = build_file_records(songs)
+    text_map = text_map_from_files(files)
+    out = {
+        "text_map": text_map,
+        "mbid_map": mbid_map_from_files(files),
+        "artist_map": build_artist_map(text_map),
+        "trigram_map": build_trigram_map(text_map),
+        "files": files,
+        "meta": {
+            "mpd_host": "synthetic", "mpd_port": 0, "db_update": str(seed), "total_files": len(files),
+            "tagged_files": len(files), "mbid_files": sum(1 for rec in files.values() if rec.get("m")),
+            "build": "synthetic", "scan": "synthetic", "workers": 1, "shards": 1, "round_trips": 0,
+            "scan_seconds": 0,
+        },
+    }
+    with redirect_stdout(io.StringIO()):
+        write_index(argparse.Namespace(index=path, binary=False), out, Progress())
+    stats = {
+        "files": len(files),
+        "keys": len(text_map),
+        "artists": len(out["artist_map"]),
+        "paren_copies": sum(1 for f in files if PAREN_COPY_RE.search(f)),
+        "mbids": len(out["mbid_map"]),
+    }
+    return out, stats
+
+
+def write_synth_responses(path: str, idx: dict, seed: int, popular: int, limit: int):
+    """
+    getSimilar responses for `popular` tracks as a --replay directory. Each
+    lists `limit` recommendations: mostly other popular tracks as tagged,
+    some misspelled (perturb()), the rest unknown to the library. Returns
+    the (artist, title) to seed a run from.
+    """
+    from lastfm_cache import ResponseArchive
+
+    rng = random.Random(seed + 1)
+    files, text_map = idx["files"], idx["text_map"]
+    pop = []
+    for key in rng.sample(sorted(text_map), min(popular, len(text_map))):
+        rec = files[sorted(text_map[key])[0]]
+        pop.append((rec["a"], rec["t"], (rec.get("m") or [""])[0]))
+    artists = sorted({a for a, _, _ in pop})
+    archive = ResponseArchive(path)
+    for artist, title, _ in pop:
+        recs = []
+        for i in range(limit):
+            r = rng.random()
+            a, t, mbid = rng.choice(pop)
+            if r < 0.6:
+                mbid = mbid if rng.random() < 0.5 else ""
+            elif r < 0.75:
+                kind, a, t = perturb(rng, a, t, rng.choice(artists))
+                if kind == "suffix":
+                    a = f"{a} {rng.choice(['Band', 'Trio', 'Orchestra'])}"
+                mbid = ""
+            else:
+                a, t, mbid = synth_artist(rng), f"{synth_word(rng)} {synth_word(rng).lower()}", ""
+            recs.append({"name": t, "artist": {"name": a}, "mbid": mbid, "match": round(1 - i / limit, 4)})
+        archive.save(artist, title, limit, recs)
+    return pop[0][0], pop[0][1]
+
+
+def synth_child(args):
+    from lastfm_vibe_radio import APPROX_THRESHOLD, VibeWorker, main as vibe_main, match_similar
+
+    rss0, _ = rss_kb()
+    worker = VibeWorker()
+    t0 = time.perf_counter()
+    lib = worker.index(args.index)
+    load_s = time.perf_counter() - t0
+    rss1, load_peak = rss_kb()
+
+    hop_s = []
+    candidates = 0
+    for name in sorted(os.listdir(args.replay))[:args.hops]:
+        with open(os.path.join(args.replay, name), "r", encoding="utf-8") as f:
+            sim = json.load(f)["tracks"]
+        t0 = time.perf_counter()
+        rows, _ = match_similar(sim, lib["mbid_map"], lib["text_map"], lib["artist_map"], set(), set(),
+                                False, lib["trigram_map"], APPROX_THRESHOLD)
+        hop_s.append(time.perf_counter() - t0)
+        candidates += len(rows)
+    hop_s.sort()
+
+    with tempfile.NamedTemporaryFile(suffix=".json", delete=False) as jf:
+        summary_path = jf.name
+    argv = [
+        "--index", args.index, "--replay", args.replay, "--dry-run",
+        # A socket path that does not exist: replay + dry-run continues offline.
+        "--host", os.path.join(os.path.dirname(summary_path), f"no-mpd-{os.getpid()}.sock"),
+        "--seed-artist", args.seed_artist, "--seed-title", args.seed_title,
+        "--target-queue", str(args.target), "--similar-limit", str(args.limit),
+        "--rng-seed", "1", "--max-misses", "20", "--json-out", summary_path,
+        "--approx-threshold", str(APPROX_THRESHOLD),
+    ]
+    try:
+        t0 = time.perf_counter()
+        with redirect_stdout(io.StringIO()):
+            vibe_main(argv, worker)
+        run_s = time.perf_counter() - t0
+        with open(summary_path, "r", encoding="utf-8") as f:
+            summary = json.load(f)
+    finally:
+        os.unlink(summary_path)
+    _, run_peak = rss_kb()
+
+    print(json.dumps({
+        "load_ms": round(load_s * 1000, 2),
+        "rss_kb": rss1 - rss0,
+        "peak_rss_kb": load_peak,
+        "hop_ms_p50": round(hop_s[len(hop_s) // 2] * 1000, 3) if hop_s else 0,
+        "hop_ms_p95": round(hop_s[min(len(hop_s) - 1, int(0.95 * len(hop_s)))] * 1000, 3) if hop_s else 0,
+        "match_hops": len(hop_s),
+        "candidates": candidates,
+        "tracks": len(summary["tracks"]),
+        "hops": summary["hops"],
+        "run_s": round(run_s, 3),
+        "replay_missing": (summary.get("replay") or {}).get("missing", 0),
+        "run_peak_rss_kb": run_peak,
+    }))
+
+
+def synth_bench(args):
+    from build_moode_index import binary_maps
+
+    workdir = args.dir or tempfile.mkdtemp(prefix="vibe-synth-")
+    os.makedirs(workdir, exist_ok=True)
+    try:
+        for size in [int(s) for s in args.sizes.split(",") if s.strip()]:
+            name = f"synth_{size}_{args.seed}"
+            json_path = os.path.join(workdir, name + ".json")
+            replay_dir = os.path.join(workdir, name + ".replay")
+            # Kept out of binary_path_for(json_path), so the JSON run parses the JSON.
+            bin_path = os.path.join(workdir, "bin", name + ".bin")
+            meta_path = os.path.join(workdir, name + ".synth.json")
+
+            idx = None
+            t0 = time.perf_counter()
+            if os.path.exists(meta_path) and os.path.exists(json_path):
+                with open(meta_path, "r", encoding="utf-8") as f:
+                    meta = json.load(f)
+                gen_s = 0.0
+            else:
+                idx, stats = write_synth_index(json_path, size, args.seed)
+                seed_artist, seed_title = write_synth_responses(replay_dir, idx, args.seed, args.popular, args.limit)
+                gen_s = time.perf_counter() - t0
+                meta = {**stats, "seed_artist": seed_artist, "seed_title": seed_title}
+                with open(meta_path, "w", encoding="utf-8") as f:
+                    json.dump(meta, f)
+            emit("synth-index", size=size, **{k: v for k, v in meta.items() if not k.startswith("seed_")},
+                 bytes=os.path.getsize(json_path), gen_s=round(gen_s, 2))
+
+            formats = [("json", json_path)]
+            if args.binary:
+                if not os.path.exists(bin_path):
+                    if idx is None:
+                        with open(json_path, "r", encoding="utf-8") as f:
+                            idx = json.load(f)
+                    os.makedirs(os.path.dirname(bin_path), exist_ok=True)
+                    write_binary_index(bin_path, binary_maps(idx), idx.get("header"))
+                formats.append(("bin", bin_path))
+            del idx
+
+            for fmt, path in formats:
+                runs = []
+                for _ in range(args.repeat):
+                    res = subprocess.run(
+                        [sys.executable, __file__, "_synth-child", "--index", path, "--replay", replay_dir,
+                         "--seed-artist", meta["seed_artist"], "--seed-title", meta["seed_title"],
+                         "--target", str(args.target), "--limit", str(args.limit), "--hops", str(args.hops)],
+                        check=True, capture_output=True, text=True,
+                    )
+                    runs.append(json.loads(res.stdout.strip().splitlines()[-1]))
+                r = min(runs, key=lambda x: x["load_ms"])
+                emit("synth-load", size=size, format=fmt, bytes=os.path.getsize(path),
+                     load_ms=r["load_ms"], rss_kb=r["rss_kb"], peak_rss_kb=r["peak_rss_kb"])
+                emit("synth-match", size=size, format=fmt, hops=r["match_hops"], hop_ms_p50=r["hop_ms_p50"],
+                     hop_ms_p95=r["hop_ms_p95"], candidates_per_hop=round(r["candidates"] / max(1, r["match_hops"]), 1))
+                emit("synth-run", size=size, format=fmt, tracks=r["tracks"], hops=r["hops"], run_s=r["run_s"],
+                     tracks_per_s=round(r["tracks"] / max(1e-9, r["run_s"]), 1),
+                     replay_missing=r["replay_missing"], peak_rss_kb=r["run_peak_rss_kb"])
+    finally:
+        if not args.dir:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+
+# -----------------------------
+# http: Last.fm client against a local stand-in server
+# -----------------------------
+
+class FakeLastfmHandler(BaseHTTPRequestHandler):
+    """
+    Answers track.getSimilar like Last.fm. Special titles: "flaky-N" fails
+    with error 8 N times then succeeds, "slow" sleeps before answering.
+    """
+    protocol_version = "HTTP/1.1"
+    connections = 0
+    seen = {}
+    lock = threading.Lock()
+
+    def setup(self):
+        super().setup()
+        # Headers and body go out as separate writes; without this, Nagle +
+        # delayed ACK add ~40 ms to every keep-alive response.
+        self.connection.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        with self.lock:
+            FakeLastfmHandler.connections += 1
+
+    def log_message(self, *args):
+        pass
+
+    def do_GET(self):
+        q = {k: v[0] for k, v in parse_qs(urlparse(self.path).query).items()}
+        track = q.get("track", "")
+        with self.lock:
+            n = self.seen[track] = self.seen.get(track, 0) + 1
+        if track == "slow":
+            time.sleep(2.0)
+        if track.startswith("flaky-") and n <= int(track.split("-", 1)[1]):
+            body = {"error": 8, "message": "Operation failed"}
+        else:
+            limit = int(q.get("limit") or 10)
+            body = {"similartracks": {"track": [
+                {"name": f"{track} {i}", "artist": {"name": q.get("artist", "")}, "mbid": ""}
+                for i in range(limit)
+            ]}}
+        data = json.dumps(body).encode()
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+
+def http_bench(args):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), FakeLastfmHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    root = f"http://127.0.0.1:{server.server_address[1]}/2.0/"
+    lastfm_client.BACKOFF_BASE = 0.02
+    failures = []
+
+    def per_call(fn):
+        FakeLastfmHandler.connections = 0
+        t0 = time.perf_counter()
+        for i in range(args.calls):
+            fn(f"track {i}")
+        return round((time.perf_counter() - t0) * 1e6 / args.calls, 1), FakeLastfmHandler.connections
+
+    def fresh(title):
+        r = requests.get(root, params={"method": "track.getSimilar", "artist": "a", "track": title,
+                                       "limit": str(args.limit), "format": "json"}, timeout=(5, 20))
+        return r.json()
+
+    client = LastfmClient("bench", rate=0, root=root)
+    for name, fn in (("no-reuse", fresh), ("session", lambda t: client.get_similar("a", t, args.limit))):
+        us, conns = per_call(fn)
+        emit("http", case=name, calls=args.calls, per_call_us=us, connections=conns)
+
+    # Retries: error 8 twice, then an answer.
+    client.stats["retries"] = 0
+    tracks = client.get_similar("a", "flaky-2", 5)
+    if len(tracks) != 5 or client.stats["retries"] != 2:
+        failures.append(f"flaky: {len(tracks)} tracks, {client.stats['retries']} retries")
+    emit("http", case="retry", tracks=len(tracks), retries=client.stats["retries"])
+
+    # Deadline: a 2 s response with 0.5 s left must give up near 0.5 s.
+    client.deadline = time.monotonic() + 0.5
+    t0 = time.perf_counter()
+    try:
+        client.get_similar("a", "slow", 5)
+        failures.append("slow: returned despite deadline")
+    except (DeadlineExceeded, RuntimeError):
+        pass
+    elapsed = time.perf_counter() - t0
+    if elapsed > 1.0:
+        failures.append(f"slow: gave up after {elapsed:.2f}s")
+    emit("http", case="deadline", budget_s=0.5, gave_up_s=round(elapsed, 2))
+    client.close()
+
+    # Token bucket: 20 calls at 40/s (burst 1) take at least ~0.475 s.
+    client = LastfmClient("bench", rate=40, burst=1, root=root)
+    t0 = time.perf_counter()
+    for i in range(20):
+        client.get_similar("a", f"rate {i}", 1)
+    elapsed = time.perf_counter() - t0
+    if elapsed < 19 / 40 * 0.95:
+        failures.append(f"rate: 20 calls in {elapsed:.3f}s")
+    emit("http", case="rate", rate=40, calls=20, elapsed_s=round(elapsed, 3))
+    client.close()
+    server.shutdown()
+
+    for f in failures:
+        print(f"FAIL {f}", file=sys.stderr)
+    if failures:
+        raise SystemExit(1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline vibe index/matcher benchmarks.")
+    sub = ap.add_subparsers(dest="cmd", required=True)
+
+    p = sub.add_parser("index-load", help="Compare JSON parse vs binary mmap load time and RSS")
+    p.add_argument("--index", default="moode_library_index.json")
+    p.add_argument("--lookups", type=int, default=2000)
+    p.add_argument("--repeat", type=int, default=3)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--rebuild-bin", action="store_true")
+    p.set_defaults(func=index_load)
+
+    p = sub.add_parser("match", help="Per-hop fuzzy matching time, linear scan vs artist_map")
+    p.add_argument("--index", default="moode_library_index.json")
+    p.add_argument("--hops", type=int, default=5)
+    p.add_argument("--per-hop", type=int, default=150)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=match)
+
+    p = sub.add_parser("approx", help="Trigram matching: hit rate on misspelled/collab/decoy recommendations, latency")
+    p.add_argument("--index", default="moode_library_index.json")
+    p.add_argument("--replay", default="", help="Use the recommendations in a --record directory")
+    p.add_argument("--recs", type=int, default=2000)
+    p.add_argument("--threshold", type=float, default=0.75)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=approx_bench)
+
+    p = sub.add_parser("synth", help="Synthetic libraries: index load, RSS, per-hop match time, tracks/s over replayed getSimilar")
+    p.add_argument("--sizes", default="10000,100000", help="Comma-separated library sizes (files), e.g. 10000,100000,1000000")
+    p.add_argument("--dir", default="", help="Keep generated indexes here and reuse them (default: temp dir, removed)")
+    p.add_argument("--binary", action="store_true", help="Also measure the mmapped .bin index")
+    p.add_argument("--popular", type=int, default=1000, help="Tracks with a canned getSimilar response")
+    p.add_argument("--limit", type=int, default=100, help="Recommendations per canned response")
+    p.add_argument("--target", type=int, default=50, help="Queue length of the end-to-end run")
+    p.add_argument("--hops", type=int, default=50, help="Canned responses timed through match_similar")
+    p.add_argument("--repeat", type=int, default=1)
+    p.add_argument("--seed", type=int, default=1)
+    p.set_defaults(func=synth_bench)
+
+    p = sub.add_parser("norm", help="Check shared norm() is byte-identical to the old copy, and time it")
+    p.add_argument("--size", type=int, default=200000)
+    p.add_argument("--seed", type=int, default=1)
+    p.add_argument("--index", default="", help="Also check an index's keys for idempotence")
+    p.set_defaults(func=norm_bench)
+
+    p = sub.add_parser("http", help="Last.fm client vs a local stand-in server: connection reuse, retries, deadline, rate")
+    p.add_argument("--calls", type=int, default=300)
+    p.add_argument("--limit", type=int, default=150)
+    p.set_defaults(func=http_bench)
+
+    p = sub.add_parser("_index-load-child")
+    p.add_argument("--format", choices=["json", "bin"], required=True)
+    p.add_argument("--index", required=True)
+    p.add_argument("--keys", required=True)
+    p.set_defaults(func=index_load_child)
+
+    p = sub.add_parser("_synth-child")
+    p.add_argument("--index", required=True)
+    p.add_argument("--replay", required=True)
+    p.add_argument("--seed-artist", required=True)
+    p.add_argument("--seed-title", required=True)
+    p.add_argument("--target", type=int, required=True)
+    p.add_argument("--limit", type=int, required=True)
+    p.add_argument("--hops", type=int, required=True)
+    p.set_defaults(func=synth_child)
+
+    args = ap.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,96 +1,757 @@
 #!/usr/bin/env python3
+import argparse
 import json
 import os
-import re
-from mpd import MPDClient
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from queue import Empty, Queue
+from mpd import MPDClient, CommandError, ConnectionError as MPDConnectionError
+
+from moode_index import (
+    INDEX_SCHEMA, JSON_HEADER_BYTES, LAZY_SECTIONS, build_artist_map, build_tag_map, build_trigram_map,
+    binary_path_for, check_header, content_hasher, json_header_block, read_header, trigram_keys,
+    write_binary_index,
+)
+from moode_norm import norm
 
 INDEX_PATH = os.environ.get("INDEX_PATH", "/opt/now-playing/moode_library_index.json")
 MPD_HOST = os.environ.get("MPD_HOST", "moode.local")
 MPD_PORT = int(os.environ.get("MPD_PORT", "6600"))
-
-TITLE_JUNK = [
-    "album version", "single version", "radio edit", "edit",
-    "remaster", "remastered", "live", "live album version",
-    "mono", "stereo", "bonus track", "deluxe edition", "expanded edition",
-]
-
-def norm(s: str) -> str:
-    if not s:
-        return ""
-    s = s.casefold().strip()
-    s = re.sub(r"\s*\(.*?\)\s*", " ", s)
-    s = re.sub(r"\s*\[.*?\]\s*", " ", s)
-    s = re.sub(r"\b(feat|ft)\.?\b.*$", "", s)
-    for junk in TITLE_JUNK:
-        s = s.replace(junk, " ")
-    s = re.sub(r"[^a-z0-9]+", " ", s)
-    return re.sub(r"\s+", " ", s).strip()
+INDEX_WORKERS = max(1, int(os.environ.get("INDEX_WORKERS", "1") or "1"))
+INDEX_BINARY = os.environ.get("INDEX_BINARY", "").strip().lower() in ("1", "true", "yes", "y", "on")
 
 def as_str(v):
     if isinstance(v, list):
         return str(v[0] if v else "")
     return str(v or "")
 
+def as_list(v):
+    if isinstance(v, list):
+        return [str(x or "") for x in v]
+    return [str(v)] if v else []
 
-def main():
+
+# MPD's MUSICBRAINZ_TRACKID holds the recording MBID (what Last.fm returns as
+# a track "mbid"); RELEASETRACKID is the track-on-release ID. Index both.
+MBID_TAGS = ("musicbrainz_trackid", "musicbrainz_releasetrackid")
+
+# Recorded in the index header; INDEX_SCHEMA (moode_index) is what readers check.
+BUILDER_VERSION = "2.0"
+
+
+def binary_maps(idx: dict) -> dict:
+    """Lookup maps mirrored into the binary index."""
+    return {
+        "text_map": idx.get("text_map") or {},
+        "mbid_map": idx.get("mbid_map") or {},
+        "artist_map": idx.get("artist_map") or {},
+        "trigram_map": trigram_keys(idx.get("trigram_map") or {}, idx.get("text_map") or {}),
+        "tag_map": build_tag_map(idx.get("files") or {}),
+    }
+
+
+class Progress:
+    """
+    Per-phase timings (stored in meta.timings) and, with --progress-json,
+    JSON-line events on stdout so callers can show progress and spot a
+    stalled build. tick() is called from scan worker threads.
+
+    Phases: listing, tag_fetch, normalization, write. In streamed scans tags
+    arrive while files are normalized, so tag_fetch is the scan's wall time
+    minus the normalization time spent inside it.
+    """
+
+    def __init__(self, emit_json: bool = False, interval: float = 1.0):
+        self.emit_json = emit_json
+        self.interval = interval
+        self.expected = 0
+        self.files = 0
+        self.timings = {}
+        self._lock = threading.Lock()
+        self._t0 = time.monotonic()
+        self._last_emit = self._t0
+        self._phase = ""
+        self._phase_t0 = self._t0
+
+    def emit(self, event: str, **fields):
+        if self.emit_json:
+            print(json.dumps({"event": event, "elapsed_s": round(time.monotonic() - self._t0, 3), **fields}), flush=True)
+
+    def add(self, phase: str, seconds: float):
+        with self._lock:
+            self.timings[phase] = self.timings.get(phase, 0.0) + seconds
+
+    def phase(self, name: str):
+        """End the current phase (if any) and start `name` ("" = none)."""
+        now = time.monotonic()
+        if self._phase:
+            spent = now - self._phase_t0
+            if self._phase == "tag_fetch":
+                spent = max(0.0, spent - self.timings.get("normalization", 0.0))
+            self.add(self._phase, spent)
+        self._phase, self._phase_t0 = name, now
+        if name:
+            self.emit("phase", phase=name, files=self.files, expected=self.expected)
+
+    def tick(self, n: int = 1):
+        with self._lock:
+            self.files += n
+            now = time.monotonic()
+            if not self.emit_json or now - self._last_emit < self.interval:
+                return
+            self._last_emit = now
+            files = self.files
+        elapsed = now - self._phase_t0
+        rate = files / elapsed if elapsed > 0 else 0.0
+        eta = (self.expected - files) / rate if rate > 0 and self.expected > files else 0.0
+        self.emit("progress", phase=self._phase, files=files, expected=self.expected,
+                  files_per_sec=round(rate, 1), eta_s=round(eta, 1))
+
+    def rounded(self) -> dict:
+        return {k: round(v, 3) for k, v in self.timings.items()}
+
+
+def mpd_connect(host: str, port: int) -> MPDClient:
     c = MPDClient()
     c.timeout = 30
     c.idletimeout = None
-    c.connect(MPD_HOST, MPD_PORT)
+    c.connect(host, port)
+    return c
 
-    # Pull everything MPD knows. This is usually fast enough.
-    files = c.listall("")
 
-    text_map = {}
-    total = 0
-    tagged = 0
+# -----------------------------
+# Library scanners
+# -----------------------------
+# Each scanner yields MPD song dicts (with "file" plus whatever tags MPD
+# returned) under directory `root` ("" = whole library) and counts protocol
+# round trips in stats["round_trips"].
+
+def scan_listallinfo(c: MPDClient, stats: dict, root: str = ""):
+    """One streamed listallinfo for the whole tree: a single round trip."""
+    stats["round_trips"] += 1
+    c.iterate = True
+    try:
+        for item in c.listallinfo(root):
+            if "file" in item:
+                yield item
+    finally:
+        c.iterate = False
+
+
+def scan_lsinfo_walk(c: MPDClient, stats: dict, root: str = ""):
+    """
+    Walk the tree with one lsinfo per directory.
+
+    Used when listallinfo is too big for MPD's max_output_buffer_size;
+    cost scales with directory count, not file count.
+    """
+    pending = [root]
+    while pending:
+        d = pending.pop()
+        stats["round_trips"] += 1
+        try:
+            entries = c.lsinfo(d)
+        except CommandError:
+            continue
+        for item in entries:
+            if "directory" in item:
+                pending.append(item["directory"])
+            elif "file" in item:
+                yield item
 
+
+def scan_find_per_file(c: MPDClient, stats: dict, root: str = ""):
+    """Legacy mode: listall, then one find per file."""
+    stats["round_trips"] += 1
+    files = c.listall(root)
     for item in files:
         f = (item.get("file") or "").strip()
         if not f:
             continue
-        total += 1
+        stats["round_trips"] += 1
         try:
             info = c.find("file", f)
         except Exception:
             continue
-        if not info:
-            continue
-        md = info[0]
-        artist = as_str(md.get("artist")).strip()
-        title = as_str(md.get("title")).strip()
-        if not artist or not title:
-            continue
+        if info:
+            yield info[0]
+        else:
+            yield {"file": f}
+
+
+SCANNERS = {
+    "bulk": scan_listallinfo,
+    "walk": scan_lsinfo_walk,
+    "per-file": scan_find_per_file,
+}
+
+
+def song_record(md: dict):
+    """
+    Return (file, record) for one MPD song dict. The record carries the
+    last-modified stamp, text key ("" when untagged), MBIDs, and the tags
+    vibe runs need (see moode_index.TAG_FIELDS) so they can skip Mutagen.
+    """
+    f = (md.get("file") or "").strip()
+    if not f:
+        return None, None
+    artist = as_str(md.get("artist")).strip()
+    title = as_str(md.get("title")).strip()
+    k = ""
+    if artist and title:
         k = f"{norm(artist)}|{norm(title)}"
+    rec = {"lm": as_str(md.get("last-modified")).strip(), "k": k}
+    mbids = []
+    for tag in MBID_TAGS:
+        for v in as_list(md.get(tag)):
+            v = v.strip().lower()
+            if v and v not in mbids:
+                mbids.append(v)
+    if mbids:
+        rec["m"] = mbids
+    album = as_str(md.get("album")).strip()
+    genre = as_str(md.get("genre")).strip()
+    duration = as_str(md.get("duration") or md.get("time")).strip()
+    for field, value in (("a", artist), ("t", title), ("al", album), ("g", genre), ("d", duration)):
+        if value:
+            rec[field] = value
+    return f, rec
+
+
+def build_file_records(songs, progress: Progress = None) -> dict:
+    files = {}
+    norm_s = 0.0
+    for md in songs:
+        t = time.monotonic()
+        f, rec = song_record(md)
+        norm_s += time.monotonic() - t
+        if f:
+            files[f] = rec
+            if progress:
+                progress.tick()
+    if progress:
+        progress.add("normalization", norm_s)
+    return files
+
+
+def text_map_from_files(files: dict) -> dict:
+    """key -> files, in sorted key order: trigram_map ids refer to this order."""
+    text_map = {}
+    for f, rec in files.items():
+        k = rec.get("k") or ""
         if not k or "|" not in k:
             continue
-        tagged += 1
         text_map.setdefault(k, []).append(f)
+    return dict(sorted(text_map.items()))
+
+
+def mbid_map_from_files(files: dict) -> dict:
+    mbid_map = {}
+    for f, rec in files.items():
+        for mbid in rec.get("m") or ():
+            mbid_map.setdefault(mbid, []).append(f)
+    return mbid_map
+
+
+def scan_library(c: MPDClient, host: str, port: int, mode: str, stats: dict, root: str = ""):
+    """
+    Run the requested scanner and return (client, files). In bulk mode, fall
+    back to the lsinfo walk if MPD refuses or drops the single large
+    listallinfo response; the client is reconnected in that case.
+    """
+    try:
+        return c, build_file_records(SCANNERS[mode](c, stats, root), stats.get("progress"))
+    except (CommandError, MPDConnectionError, OSError) as e:
+        if mode != "bulk":
+            raise
+        print(f"listallinfo failed ({e.__class__.__name__}: {e}); falling back to lsinfo walk", flush=True)
+        stats["fallback"] = "walk"
+        try:
+            c.disconnect()
+        except Exception:
+            pass
+        c = mpd_connect(host, port)
+        return c, build_file_records(scan_lsinfo_walk(c, stats, root), stats.get("progress"))
+
+
+# -----------------------------
+# Sharded parallel scans
+# -----------------------------
+# One MPDClient connection serializes all protocol I/O, and MPD has idle
+# cores while the builder waits on the socket. With --workers N the library
+# is split by top-level directory (USB/..., OSDISK/..., NAS shares), N
+# threads each open one connection and pull shards from a shared queue, and
+# shards are merged in sorted order so the index does not depend on which
+# thread finishes first.
+
+def list_shards(c: MPDClient, workers: int, stats: dict):
+    """
+    Return (shard_dirs, loose_songs). Directories are split one more level
+    (at most twice) while there are fewer shards than workers; songs sitting
+    directly in an expanded directory come back as loose_songs.
+    """
+    stats["round_trips"] += 1
+    entries = c.lsinfo("")
+    dirs = sorted(e["directory"] for e in entries if "directory" in e)
+    loose = [e for e in entries if "file" in e]
+    for _ in range(2):
+        if len(dirs) >= workers:
+            break
+        expanded = []
+        expanded_loose = []
+        for d in dirs:
+            stats["round_trips"] += 1
+            sub = c.lsinfo(d)
+            expanded.extend(e["directory"] for e in sub if "directory" in e)
+            expanded_loose.extend(e for e in sub if "file" in e)
+        if not expanded:
+            # Nothing to split further: keep dirs as shards, which will
+            # scan their own files.
+            break
+        dirs = sorted(expanded)
+        loose.extend(expanded_loose)
+    return dirs, loose
+
+
+def scan_shard_worker(host: str, port: int, mode: str, shards: Queue, results: list, progress: Progress = None):
+    """Drain shard dirs from the queue on one MPD connection."""
+    stats = {"round_trips": 0, "progress": progress}
+    c = mpd_connect(host, port)
+    try:
+        while True:
+            try:
+                i, root = shards.get_nowait()
+            except Empty:
+                break
+            c, results[i] = scan_library(c, host, port, mode, stats, root)
+    finally:
+        try:
+            c.disconnect()
+        except Exception:
+            pass
+    return stats
+
 
-    c.disconnect()
+def scan_library_parallel(c: MPDClient, host: str, port: int, mode: str, workers: int, stats: dict) -> dict:
+    progress = stats.get("progress")
+    dirs, loose = list_shards(c, workers, stats)
+    if progress:
+        progress.phase("tag_fetch")
+    shards = Queue()
+    for i, d in enumerate(dirs):
+        shards.put((i, d))
+    results = [None] * len(dirs)
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(scan_shard_worker, host, port, mode, shards, results, progress)
+                   for _ in range(min(workers, len(dirs)))]
+        for fut in futures:
+            worker_stats = fut.result()
+            stats["round_trips"] += worker_stats["round_trips"]
+            if worker_stats.get("fallback"):
+                stats["fallback"] = worker_stats["fallback"]
 
-    out = {
+    # Merge in shard order, not completion order.
+    files = build_file_records(loose, progress)
+    for shard_files in results:
+        files.update(shard_files)
+    stats["shards"] = len(dirs)
+    return files
+
+
+# -----------------------------
+# Incremental rebuilds
+# -----------------------------
+# A full listallinfo is only needed on the first build. Afterwards the index
+# carries MPD's db_update stamp and a {"lm", "k"} record per file, so a
+# rebuild can skip entirely when the database is unchanged, or re-key only
+# the files that were added, modified or removed since the last build.
+
+# Above this many added-but-not-modified files (e.g. copied with preserved
+# mtimes) a fresh bulk scan is cheaper than one find per file.
+MAX_PER_FILE_LOOKUPS = 500
+
+
+def load_previous_index(path: str):
+    # Header-less (pre-schema) or other-schema indexes get a full rescan.
+    header = read_header(path)
+    if header is None or check_header(header):
+        return None
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            idx = json.load(f)
+    except Exception:
+        return None
+    if not isinstance(idx, dict) or not isinstance(idx.get("files"), dict):
+        return None
+    return idx
+
+
+def index_unchanged(args, db_update: str) -> bool:
+    """Header-only check that the index on disk already matches MPD's db_update."""
+    header = read_header(args.index)
+    return bool(
+        header and db_update and not check_header(header)
+        and header.get("mpd") == f"{args.host}:{args.port}"
+        and header.get("db_update") == db_update
+    )
+
+
+def mpd_db_stats(c: MPDClient, stats: dict):
+    """Return (db_update, song count) from MPD stats."""
+    stats["round_trips"] += 1
+    st = c.stats()
+    try:
+        songs = int(st.get("songs") or 0)
+    except ValueError:
+        songs = 0
+    return str(st.get("db_update") or ""), songs
+
+
+def incremental_update(c: MPDClient, old_files: dict, since: str, stats: dict):
+    """
+    Apply library changes since db_update `since` to a copy of old_files.
+
+    Returns (files, counts) or None when the change set is too large and a
+    full scan should be used instead.
+    """
+    progress = stats.get("progress")
+    stats["round_trips"] += 1
+    current = {(item.get("file") or "").strip() for item in c.listall("") if item.get("file")}
+    if progress:
+        progress.phase("tag_fetch")
+
+    files = {f: rec for f, rec in old_files.items() if f in current}
+    removed = len(old_files) - len(files)
+    added = 0
+    changed = 0
+
+    stats["round_trips"] += 1
+    for f, rec in build_file_records(c.find(f"(modified-since '{since}')"), progress).items():
+        if f not in current:
+            continue
+        prev = files.get(f)
+        if prev is None:
+            added += 1
+        elif prev == rec:
+            continue
+        else:
+            changed += 1
+        files[f] = rec
+
+    missing = [f for f in current if f not in files]
+    if len(missing) > MAX_PER_FILE_LOOKUPS:
+        return None
+    for f in missing:
+        stats["round_trips"] += 1
+        try:
+            info = c.find("file", f)
+        except CommandError:
+            continue
+        _, rec = song_record(info[0] if info else {"file": f})
+        files[f] = rec
+        added += 1
+
+    return files, {"added": added, "changed": changed, "removed": removed}
+
+
+def build_index(args, prev, progress: Progress):
+    """
+    Bring the index up to date against MPD. Returns the new index dict, or
+    None when MPD's db_update matches `prev` (the file is only touched).
+
+    With prev=None the index on disk is used: its header answers the
+    unchanged case, and it is only parsed when an incremental update is due.
+    """
+    stats = {"scan": args.scan, "round_trips": 0, "progress": progress}
+    t0 = time.monotonic()
+    progress.phase("listing")
+    c = mpd_connect(args.host, args.port)
+    try:
+        db_update, songs = mpd_db_stats(c, stats)
+        if prev is None and not args.full:
+            if index_unchanged(args, db_update):
+                touch_index(args, None)
+                progress.phase("")
+                progress.emit("done", build="unchanged", db_update=db_update, timings=progress.rounded())
+                print(f"Index up to date: {args.index} (db_update {db_update}) | MPD round trips: {stats['round_trips']} | {time.monotonic() - t0:.2f}s", flush=True)
+                return None
+            prev = load_previous_index(args.index)
+        prev_meta = (prev or {}).get("meta") or {}
+        if prev and (prev_meta.get("mpd_host"), prev_meta.get("mpd_port")) != (args.host, args.port):
+            prev = None
+
+        if prev and db_update and prev_meta.get("db_update") == db_update:
+            # Nothing changed: refresh mtime so freshness checks stay happy.
+            touch_index(args, prev)
+            progress.phase("")
+            progress.emit("done", build="unchanged", db_update=db_update, timings=progress.rounded())
+            print(f"Index up to date: {args.index} (db_update {db_update}) | MPD round trips: {stats['round_trips']} | {time.monotonic() - t0:.2f}s", flush=True)
+            return None
+
+        build = "full"
+        counts = {}
+        files = None
+        if prev and db_update and prev_meta.get("db_update"):
+            try:
+                res = incremental_update(c, prev["files"], prev_meta["db_update"], stats)
+            except CommandError as e:
+                # MPD < 0.21 has no filter expressions.
+                print(f"incremental update unavailable ({e}); doing full scan", flush=True)
+                res = None
+            if res is not None:
+                files, counts = res
+                build = "incremental"
+        if files is None:
+            progress.files = 0
+            progress.expected = songs
+        if files is None and args.workers > 1:
+            files = scan_library_parallel(c, args.host, args.port, args.scan, args.workers, stats)
+        elif files is None:
+            progress.phase("tag_fetch")
+            c, files = scan_library(c, args.host, args.port, args.scan, stats)
+    finally:
+        try:
+            c.disconnect()
+        except Exception:
+            pass
+    progress.phase("")
+    scan_seconds = time.monotonic() - t0
+
+    t = time.monotonic()
+    # Scan order depends on --scan, --workers and incremental updates; sort
+    # so the same library always writes the same bytes (and header hash).
+    files = dict(sorted(files.items()))
+    text_map = text_map_from_files(files)
+    mbid_map = mbid_map_from_files(files)
+    artist_map = build_artist_map(text_map)
+    trigram_map = build_trigram_map(text_map)
+    progress.add("normalization", time.monotonic() - t)
+
+    return {
         "text_map": text_map,
-        "mbid_map": {},  # optional; keep empty for now
+        "mbid_map": mbid_map,
+        "artist_map": artist_map,
+        "trigram_map": trigram_map,
+        "files": files,
         "meta": {
-            "mpd_host": MPD_HOST,
-            "mpd_port": MPD_PORT,
-            "total_files": total,
-            "tagged_files": tagged,
+            "mpd_host": args.host,
+            "mpd_port": args.port,
+            "db_update": db_update,
+            "total_files": len(files),
+            "tagged_files": sum(1 for rec in files.values() if rec.get("k")),
+            "mbid_files": sum(1 for rec in files.values() if rec.get("m")),
+            "build": build,
+            **counts,
+            "scan": "incremental" if build == "incremental" else (stats.get("fallback") or args.scan),
+            "workers": args.workers if build == "full" else 1,
+            "shards": stats.get("shards", 1),
+            "round_trips": stats["round_trips"],
+            "scan_seconds": round(scan_seconds, 3),
+            "timings": progress.rounded(),
         },
     }
 
+
+def touch_index(args, idx: dict = None):
+    """Refresh the index mtime; idx=None means "as on disk" (loaded only if the .bin is missing)."""
+    os.utime(args.index)
+    if args.binary:
+        bin_path = binary_path_for(args.index)
+        bin_header = read_header(bin_path)
+        header = (idx or {}).get("header") or read_header(args.index)
+        if bin_header and header and bin_header.get("hash") == header.get("hash"):
+            os.utime(bin_path)
+            return
+        idx = idx or load_previous_index(args.index)
+        if idx:
+            write_binary_index(bin_path, binary_maps(idx), header)
+
+
+def write_index(args, out: dict, progress: Progress):
     # atomic write to avoid 0-byte index if interrupted
-    tmp = INDEX_PATH + ".tmp"
-    os.makedirs(os.path.dirname(INDEX_PATH), exist_ok=True)
+    index_path = args.index
+    tmp = index_path + ".tmp"
+    os.makedirs(os.path.dirname(index_path) or ".", exist_ok=True)
+    meta = out["meta"]
+    progress.phase("write")
     with open(tmp, "w", encoding="utf-8") as f:
-        json.dump(out, f)
-    os.replace(tmp, INDEX_PATH)
+        # Fixed-size header slot first (filled in once the content hash is
+        # known), then data sections, and meta last so it can carry the
+        # write time. json.dumps output is ASCII, so characters == bytes.
+        # The header records the byte span of each LAZY_SECTIONS value.
+        f.write(" " * JSON_HEADER_BYTES)
+        h = content_hasher()
+        pos = JSON_HEADER_BYTES
+        lazy = {}
+        for name, value in out.items():
+            if name not in ("header", "meta"):
+                prefix = f", {json.dumps(name)}: "
+                chunk = prefix + json.dumps(value)
+                h.update(chunk.encode("ascii"))
+                f.write(chunk)
+                if name in LAZY_SECTIONS:
+                    lazy[name] = [pos + len(prefix), pos + len(chunk)]
+                pos += len(chunk)
+        progress.phase("")
+        meta["timings"] = progress.rounded()
+        f.write(f', "meta": {json.dumps(meta)}}}')
+        header = {
+            "schema": INDEX_SCHEMA,
+            "builder": BUILDER_VERSION,
+            "db_update": meta["db_update"],
+            "files": meta["total_files"],
+            "hash": h.hexdigest(),
+            "mpd": f"{meta['mpd_host']}:{meta['mpd_port']}",
+            "lazy": lazy,
+        }
+        f.seek(0)
+        f.write(json_header_block(header))
+    os.replace(tmp, index_path)
+    out["header"] = header
+
+    print(f"Wrote index: {index_path} (schema {INDEX_SCHEMA}, hash {header['hash']})")
+    if args.binary:
+        bin_path = binary_path_for(index_path)
+        progress.phase("write_binary")
+        write_binary_index(bin_path, binary_maps(out), header)
+        progress.phase("")
+        print(f"Wrote binary index: {bin_path}")
+    progress.emit("done", build=meta["build"], db_update=meta["db_update"], total_files=meta["total_files"],
+                  round_trips=meta["round_trips"], timings=progress.rounded())
+    print(f"Total files: {meta['total_files']}")
+    print(f"Tagged files (artist+title): {meta['tagged_files']}")
+    print(f"Unique keys: {len(out['text_map'])}")
+    print(f"MusicBrainz-tagged files: {meta['mbid_files']} ({len(out['mbid_map'])} MBIDs)")
+    if meta["build"] == "incremental":
+        print(f"Incremental: +{meta['added']} ~{meta['changed']} -{meta['removed']} files")
+    print(f"Scan: {meta['scan']} | workers {meta['workers']} / shards {meta['shards']} | MPD round trips: {meta['round_trips']} | {meta['scan_seconds']:.2f}s", flush=True)
+
+
+# -----------------------------
+# Watch mode
+# -----------------------------
+# --watch keeps the index current so vibe jobs never pay for a rebuild. A
+# listener thread blocks in MPD "idle database" on its own connection and
+# queues each event; the main loop coalesces bursts (debounce), then applies
+# them with the same incremental update on a fresh connection. While idle it
+# touches the index every --heartbeat seconds so age-based freshness checks
+# (ensureVibeIndexReady) never trigger a rebuild of their own.
+
+def idle_listener(host: str, port: int, events: Queue):
+    while True:
+        try:
+            c = mpd_connect(host, port)
+            try:
+                while True:
+                    if "database" in c.idle("database"):
+                        events.put(time.monotonic())
+            finally:
+                try:
+                    c.disconnect()
+                except Exception:
+                    pass
+        except (MPDConnectionError, OSError) as e:
+            print(f"[watch] idle connection lost ({e.__class__.__name__}: {e}); reconnecting in 5s", flush=True)
+            # Changes may have been missed while disconnected.
+            events.put(time.monotonic())
+            time.sleep(5)
+
+
+def watch_index(args, idx):
+    events = Queue()
+    threading.Thread(target=idle_listener, args=(args.host, args.port, events), daemon=True).start()
+    print(f"[watch] watching MPD {args.host}:{args.port} database (debounce {args.debounce}s)", flush=True)
+
+    # A failure that repeats unchanged (MPD down, index dir unwritable, ...)
+    # is retried with a doubling delay, capped at --heartbeat.
+    last_error = None
+    failures = 0
+
+    while True:
+        try:
+            events.get(timeout=args.heartbeat)
+        except Empty:
+            if not os.path.exists(args.index):
+                events.put(time.monotonic())
+                continue
+            try:
+                touch_index(args, idx)
+            except OSError as e:
+                print(f"[watch] heartbeat failed ({e.__class__.__name__}: {e})", flush=True)
+            continue
+
+        # Debounce: wait until no further event arrives for --debounce seconds.
+        burst = 1
+        while True:
+            try:
+                events.get(timeout=args.debounce)
+                burst += 1
+            except Empty:
+                break
+
+        if idx is not None and not os.path.exists(args.index):
+            # Removed under us: the in-memory copy would only be "touched".
+            print(f"[watch] index missing ({args.index}); rebuilding from scratch", flush=True)
+            idx = None
+        elif failures:
+            print("[watch] retrying update", flush=True)
+        else:
+            print(f"[watch] database changed ({burst} event(s)); updating index", flush=True)
+        progress = Progress(args.progress_json)
+        try:
+            out = build_index(args, idx, progress)
+            if out is not None:
+                write_index(args, out, progress)
+                idx = out
+        except (CommandError, MPDConnectionError, OSError) as e:
+            error = f"{e.__class__.__name__}: {e}"
+            failures = failures + 1 if error == last_error else 1
+            last_error = error
+            delay = min(args.heartbeat, args.debounce * 2 ** (failures - 1))
+            repeat = f", {failures} times in a row" if failures > 1 else ""
+            print(f"[watch] update failed ({error}{repeat}); retrying in {delay:g}s", flush=True)
+            events.put(time.monotonic())
+            time.sleep(delay)
+            continue
+        last_error = None
+        failures = 0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Build moode_library_index.json from the MPD library.")
+    ap.add_argument("--index", default=INDEX_PATH)
+    ap.add_argument("--host", default=MPD_HOST)
+    ap.add_argument("--port", type=int, default=MPD_PORT)
+    ap.add_argument("--scan", choices=sorted(SCANNERS), default="bulk",
+                    help="bulk: streamed listallinfo (falls back to walk), "
+                         "walk: one lsinfo per directory, per-file: legacy listall + find per file")
+    ap.add_argument("--full", action="store_true",
+                    help="Ignore the existing index and rescan the whole library")
+    ap.add_argument("--workers", type=int, default=INDEX_WORKERS,
+                    help="Full scans: scan top-level directories on N parallel MPD connections (env INDEX_WORKERS)")
+    ap.add_argument("--binary", action="store_true", default=INDEX_BINARY,
+                    help="Also write the mmap-able binary index next to the JSON (env INDEX_BINARY=1)")
+    ap.add_argument("--watch", action="store_true",
+                    help="Stay running: apply MPD database changes to the index as they happen")
+    ap.add_argument("--debounce", type=float, default=5.0,
+                    help="Watch mode: seconds of quiet after a database event before updating")
+    ap.add_argument("--heartbeat", type=float, default=300.0,
+                    help="Watch mode: touch the index this often while idle")
+    ap.add_argument("--progress-json", action="store_true",
+                    help="Emit JSON-line phase/progress/done events (files, files/sec, ETA, timings) on stdout")
+    args = ap.parse_args()
+
+    # build_index reads the index on disk itself (header first) unless --full.
+    idx = None
+    progress = Progress(args.progress_json)
+    out = build_index(args, idx, progress)
+    if out is not None:
+        write_index(args, out, progress)
+        idx = out
 
-    print(f"Wrote index: {INDEX_PATH}")
-    print(f"Total files: {total}")
-    print(f"Tagged files (artist+title): {tagged}")
-    print(f"Unique keys: {len(text_map)}")
+    if args.watch:
+        watch_index(args, idx)
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,194 @@
+#!/usr/bin/env python3
+"""
+Crawl Last.fm track.getSimilar once per local track and keep only the edges
+that land on other tracks in the library, producing the compact graph
+(moode_graph.py) that `lastfm_vibe_radio.py --graph` chains hops over
+without the network.
+
+The crawl is slow by design (a polite --rate, default 1 request/s), so it is
+resumable: every crawled track is appended to a JSON-lines journal next to
+the graph, and a rerun skips what the journal already has. The graph file is
+recompiled from the journal at the end of every run, including an
+interrupted or --max-seconds-limited one, so a partial crawl is already
+usable. Journal entries for tracks no longer in the index are dropped at
+compile time.
+"""
+import argparse
+import json
+import os
+import time
+
+from lastfm_client import DeadlineExceeded, LastfmClient, LastfmError
+from lastfm_vibe_radio import ensure_mpd_path, match_similar, path_score, similar_rec, track_key
+from moode_graph import graph_path_for, write_graph
+from moode_index import load_index
+
+INDEX_PATH = os.environ.get("INDEX_PATH", "/opt/now-playing/moode_library_index.json")
+
+# Last.fm error 6: "Track not found". Recorded as crawled with no edges.
+NOT_FOUND = 6
+
+
+def journal_path_for(graph_path: str) -> str:
+    return graph_path + ".crawl.jsonl"
+
+
+def read_journal(path: str) -> dict:
+    """{key: [(target_key, weight)]} from a crawl journal; later lines win."""
+    adjacency = {}
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    rec = json.loads(line)
+                    adjacency[rec["k"]] = [(t, float(w)) for t, w in rec["e"]]
+                except (ValueError, KeyError, TypeError):
+                    # Torn last line from a killed crawl; that track is redone.
+                    continue
+    except FileNotFoundError:
+        pass
+    return adjacency
+
+
+def node_query(lib: dict, key: str):
+    """(artist, title) to ask Last.fm about for a text_map key: the best file's tags, else the key."""
+    for p in sorted(lib["text_map"].get(key) or (), key=path_score):
+        row = lib["tag_map"].get(ensure_mpd_path(p))
+        if row and row[0] and row[1]:
+            return row[0], row[1]
+    artist, _, title = key.partition("|")
+    return artist, title
+
+
+def local_edges(lib: dict, key: str, sim: list, max_edges: int, min_match: float) -> list:
+    """getSimilar results that resolve to another local track, as [(target_key, match)]."""
+    weights = {}
+    for t in sim:
+        artist, title, _ = similar_rec(t)
+        try:
+            weights[(artist, title)] = float(t.get("match") or 0)
+        except (TypeError, ValueError):
+            weights[(artist, title)] = 0.0
+
+    text_map = lib["text_map"]
+    rows, _ = match_similar(sim, lib["mbid_map"], text_map, lib["artist_map"], set(), set(), True)
+    best = {}
+    for rec_artist, rec_title, cand, _ in rows:
+        w = weights.get((rec_artist, rec_title), 0.0)
+        if w < min_match:
+            continue
+        # Node of the matched file (its own tags), else of the recommendation.
+        row = lib["tag_map"].get(cand)
+        target = track_key(row[0], row[1]) if row else ""
+        if target not in text_map:
+            target = track_key(rec_artist, rec_title)
+        if not target or target == key or target not in text_map:
+            continue
+        best[target] = max(w, best.get(target, 0.0))
+    edges = sorted(best.items(), key=lambda e: -e[1])
+    return [(t, round(w, 4)) for t, w in edges[:max_edges]]
+
+
+def compile_graph(args, lib: dict, adjacency: dict):
+    text_map = lib["text_map"]
+    kept = {
+        k: [(t, w) for t, w in edges if t in text_map]
+        for k, edges in adjacency.items() if k in text_map
+    }
+    hdr = lib.get("header") or {}
+    write_graph(args.graph, kept, hdr.get("hash") or "")
+    n_edges = sum(len(e) for e in kept.values())
+    size = os.path.getsize(args.graph)
+    print(f"[graph] wrote {args.graph}: {len(kept)} crawled tracks, {n_edges} edges, "
+          f"{size / 1024:.0f} KiB", flush=True)
+
+
+def crawl(args, lib: dict, adjacency: dict):
+    todo = sorted(k for k in lib["text_map"] if k not in adjacency)
+    if args.max_tracks > 0:
+        todo = todo[:args.max_tracks]
+    print(f"[graph] {len(adjacency)} tracks already crawled, {len(todo)} to go "
+          f"(rate {args.rate}/s)", flush=True)
+    if not todo:
+        return
+
+    client = LastfmClient(args.api_key, rate=args.rate, burst=1, pool_size=1)
+    if args.max_seconds > 0:
+        client.deadline = time.monotonic() + args.max_seconds
+    t0 = time.monotonic()
+    done = failed = 0
+    try:
+        with open(args.journal, "a", encoding="utf-8") as jf:
+            for key in todo:
+                artist, title = node_query(lib, key)
+                try:
+                    sim = client.get_similar(artist, title, args.limit)
+                except DeadlineExceeded:
+                    print(f"[graph] time budget reached ({args.max_seconds}s), stopping", flush=True)
+                    break
+                except LastfmError as e:
+                    if e.code != NOT_FOUND:
+                        failed += 1
+                        print(f"[graph] {artist} - {title}: {e}", flush=True)
+                        continue
+                    sim = []
+                except RuntimeError as e:
+                    failed += 1
+                    print(f"[graph] {artist} - {title}: {e}", flush=True)
+                    continue
+
+                edges = local_edges(lib, key, sim, args.max_edges, args.min_match)
+                adjacency[key] = edges
+                jf.write(json.dumps({"k": key, "e": edges}, ensure_ascii=False, separators=(",", ":")) + "\n")
+                jf.flush()
+                done += 1
+                if done % 50 == 0:
+                    rate = done / max(1e-9, time.monotonic() - t0)
+                    eta = (len(todo) - done) / rate if rate else 0
+                    print(f"[graph] crawled {done}/{len(todo)} ({rate:.2f}/s, ETA {eta / 60:.0f} min, "
+                          f"{failed} failed)", flush=True)
+    except KeyboardInterrupt:
+        print("[graph] interrupted; compiling what was crawled", flush=True)
+    finally:
+        client.close()
+    print(f"[graph] crawled {done} track(s) this run, {failed} failed (retried next run) "
+          f"in {time.monotonic() - t0:.0f}s", flush=True)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Crawl Last.fm getSimilar into a local-only similarity graph.")
+    ap.add_argument("--index", default=INDEX_PATH)
+    ap.add_argument("--graph", default="",
+                    help="Graph file (default moode_similar_graph.bin next to --index)")
+    ap.add_argument("--api-key", default=os.environ.get("LASTFM_API_KEY", ""))
+    ap.add_argument("--rate", type=float, default=1.0,
+                    help="Last.fm requests per second")
+    ap.add_argument("--limit", type=int, default=100,
+                    help="getSimilar results requested per track")
+    ap.add_argument("--max-edges", type=int, default=50,
+                    help="Strongest local edges kept per track")
+    ap.add_argument("--min-match", type=float, default=0.0,
+                    help="Drop edges with a Last.fm match score below this")
+    ap.add_argument("--max-tracks", type=int, default=0,
+                    help="Crawl at most N new tracks this run; 0 = all")
+    ap.add_argument("--max-seconds", type=float, default=0,
+                    help="Stop crawling after this long; 0 = no limit")
+    ap.add_argument("--compile-only", action="store_true",
+                    help="Rebuild the graph from the journal without crawling")
+    args = ap.parse_args()
+
+    args.graph = args.graph or graph_path_for(args.index)
+    args.journal = journal_path_for(args.graph)
+    if not args.api_key and not args.compile_only:
+        raise SystemExit("ERROR: Provide Last.fm API key via --api-key or env LASTFM_API_KEY")
+
+    lib = load_index(args.index)
+    print(f"[graph] index {lib['source']}: {len(lib['text_map'])} tracks", flush=True)
+    adjacency = read_journal(args.journal)
+    if not args.compile_only:
+        crawl(args, lib, adjacency)
+    compile_graph(args, lib, adjacency)
+
+
+if __name__ == "__main__":
+    main()
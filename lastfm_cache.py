@@ -0,0 +1,184 @@
+"""
+On-disk cache of Last.fm track.getSimilar responses for lastfm_vibe_radio.py.
+
+Vibe jobs keep asking for the same popular seeds, and each getSimilar call
+can take seconds (more with retries). Responses are stored in SQLite keyed by
+"norm(artist)|norm(title)|limit", expire after a TTL, and the table is kept
+under a size bound by evicting the least recently used rows.
+
+The cache is best-effort: any SQLite error disables it for the rest of the
+run and the caller just goes to the network.
+
+ResponseArchive is the plain-file counterpart used by --record/--replay: one
+JSON file per getSimilar response, no expiry, meant to be copied to another
+machine and replayed offline.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import time
+
+from moode_norm import norm
+
+SIMILAR_CACHE_TTL = 7 * 24 * 3600
+SIMILAR_CACHE_MAX = 5000
+
+
+def similar_key(artist: str, title: str, limit: int) -> str:
+    a = norm(artist)
+    t = norm(title)
+    return f"{a}|{t}|{int(limit)}" if a and t else ""
+
+
+class SimilarCache:
+    def __init__(self, path: str, ttl: float = SIMILAR_CACHE_TTL, max_entries: int = SIMILAR_CACHE_MAX):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.stats = {"hits": 0, "misses": 0, "expired": 0, "stored": 0, "evicted": 0, "errors": 0}
+        self._db = None
+        try:
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+            db = sqlite3.connect(path, timeout=5)
+            db.execute("PRAGMA journal_mode=WAL")
+            db.execute(
+                "CREATE TABLE IF NOT EXISTS similar ("
+                " key TEXT PRIMARY KEY, fetched REAL NOT NULL, used REAL NOT NULL, body TEXT NOT NULL)"
+            )
+            db.execute("CREATE INDEX IF NOT EXISTS similar_used ON similar (used)")
+            db.commit()
+            self._db = db
+        except (sqlite3.Error, OSError) as e:
+            self._fail(e)
+
+    @property
+    def enabled(self) -> bool:
+        return self._db is not None
+
+    def _fail(self, e: Exception):
+        self.stats["errors"] += 1
+        print(f"[cache] similar cache disabled ({self.path}): {e.__class__.__name__}: {e}", flush=True)
+        if self._db is not None:
+            try:
+                self._db.close()
+            except sqlite3.Error:
+                pass
+        self._db = None
+
+    def get(self, artist: str, title: str, limit: int):
+        """Cached track list, or None on a miss (absent, expired or cache disabled)."""
+        key = similar_key(artist, title, limit)
+        if not self.enabled or not key:
+            self.stats["misses"] += 1
+            return None
+        now = time.time()
+        try:
+            row = self._db.execute("SELECT fetched, body FROM similar WHERE key = ?", (key,)).fetchone()
+            if row is None:
+                self.stats["misses"] += 1
+                return None
+            if self.ttl > 0 and now - row[0] > self.ttl:
+                self._db.execute("DELETE FROM similar WHERE key = ?", (key,))
+                self._db.commit()
+                self.stats["expired"] += 1
+                self.stats["misses"] += 1
+                return None
+            self._db.execute("UPDATE similar SET used = ? WHERE key = ?", (now, key))
+            self._db.commit()
+            tracks = json.loads(row[1])
+        except (sqlite3.Error, ValueError) as e:
+            self._fail(e)
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        return tracks
+
+    def contains(self, artist: str, title: str, limit: int) -> bool:
+        """True when a fresh entry exists; does not count as a hit or touch LRU order."""
+        key = similar_key(artist, title, limit)
+        if not self.enabled or not key:
+            return False
+        try:
+            row = self._db.execute("SELECT fetched FROM similar WHERE key = ?", (key,)).fetchone()
+        except sqlite3.Error as e:
+            self._fail(e)
+            return False
+        return row is not None and (self.ttl <= 0 or time.time() - row[0] <= self.ttl)
+
+    def put(self, artist: str, title: str, limit: int, tracks: list):
+        key = similar_key(artist, title, limit)
+        if not self.enabled or not key:
+            return
+        now = time.time()
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO similar (key, fetched, used, body) VALUES (?, ?, ?, ?)",
+                (key, now, now, json.dumps(tracks, separators=(",", ":"))),
+            )
+            self.stats["stored"] += 1
+            if self.max_entries > 0:
+                cur = self._db.execute(
+                    "DELETE FROM similar WHERE key IN ("
+                    " SELECT key FROM similar ORDER BY used DESC LIMIT -1 OFFSET ?)",
+                    (self.max_entries,),
+                )
+                self.stats["evicted"] += max(0, cur.rowcount)
+            self._db.commit()
+        except sqlite3.Error as e:
+            self._fail(e)
+
+    def summary(self) -> dict:
+        out = dict(self.stats)
+        out["path"] = self.path
+        if self.enabled:
+            try:
+                out["entries"] = self._db.execute("SELECT COUNT(*) FROM similar").fetchone()[0]
+            except sqlite3.Error:
+                pass
+        return out
+
+    def close(self):
+        if self._db is not None:
+            try:
+                self._db.close()
+            except sqlite3.Error:
+                pass
+            self._db = None
+
+
+class ResponseArchive:
+    """getSimilar responses stored as <dir>/<hash of similar_key>.json."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.stats = {"saved": 0, "loaded": 0, "missing": 0}
+
+    def _file(self, artist: str, title: str, limit: int) -> str:
+        key = similar_key(artist, title, limit)
+        if not key:
+            return ""
+        return os.path.join(self.path, hashlib.sha1(key.encode("utf-8")).hexdigest()[:20] + ".json")
+
+    def load(self, artist: str, title: str, limit: int):
+        """Recorded track list, or None when this request was never recorded."""
+        fp = self._file(artist, title, limit)
+        try:
+            with open(fp, "r", encoding="utf-8") as f:
+                tracks = json.load(f)["tracks"]
+        except (OSError, ValueError, KeyError):
+            self.stats["missing"] += 1
+            return None
+        self.stats["loaded"] += 1
+        return tracks
+
+    def save(self, artist: str, title: str, limit: int, tracks: list):
+        fp = self._file(artist, title, limit)
+        if not fp:
+            return
+        os.makedirs(self.path, exist_ok=True)
+        tmp = f"{fp}.{os.getpid()}.tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump({"artist": artist, "title": title, "limit": int(limit), "tracks": tracks}, f)
+        os.replace(tmp, fp)
+        self.stats["saved"] += 1
@@ -0,0 +1,168 @@
+"""
+Last.fm HTTP client for lastfm_vibe_radio.py.
+
+One keep-alive requests.Session (pooled connections, so a vibe job pays for
+TLS once instead of per call), a token-bucket rate limiter shared by every
+thread using the client, and jittered exponential backoff that gives up
+rather than sleep past the job's deadline (--max-seconds).
+"""
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+# Use HTTPS (more reliable than plain HTTP) + retries below
+LASTFM_ROOT = "https://ws.audioscrobbler.com/2.0/"
+USER_AGENT = "moode-vibe/chain-2.0"
+
+MAX_ATTEMPTS = 6
+BACKOFF_BASE = 0.75
+BACKOFF_CAP = 8.0
+
+# Last.fm error 8 ("Operation failed - most likely the backend service
+# failed") and 29 (rate limit exceeded) are worth retrying.
+RETRY_ERRORS = (8, 29)
+
+NETWORK_ERRORS = (
+    requests.exceptions.ReadTimeout,
+    requests.exceptions.ConnectTimeout,
+    requests.exceptions.Timeout,
+    requests.exceptions.ConnectionError,
+)
+
+
+class DeadlineExceeded(RuntimeError):
+    pass
+
+
+class LastfmError(RuntimeError):
+    """An error response from the API; `code` is Last.fm's error number."""
+
+    def __init__(self, code: int, message: str):
+        super().__init__(f"Last.fm error {code}: {message}")
+        self.code = code
+
+
+class TokenBucket:
+    """`rate` tokens per second, up to `burst` banked; take() blocks until one is free."""
+
+    def __init__(self, rate: float, burst: int = 1):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._stamp = time.monotonic()
+        self._lock = threading.Lock()
+
+    def take(self, deadline: float = None):
+        if self.rate <= 0:
+            return
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._stamp) * self.rate)
+                self._stamp = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            if deadline is not None and now + wait > deadline:
+                raise DeadlineExceeded("rate limit wait would pass the deadline")
+            time.sleep(wait)
+
+
+class LastfmClient:
+    """
+    Thread-safe Last.fm API client. `deadline` is a time.monotonic() value
+    (None = no deadline); set it once the job's time budget is known.
+    """
+
+    def __init__(self, api_key: str, rate: float = 4.0, burst: int = 2, pool_size: int = 4,
+                 root: str = LASTFM_ROOT, timeout=(5, 20), deadline: float = None):
+        self.api_key = api_key
+        self.root = root
+        self.timeout = timeout
+        self.deadline = deadline
+        self.bucket = TokenBucket(rate, burst)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(1, pool_size))
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self.session.headers["User-Agent"] = USER_AGENT
+        self.stats = {"requests": 0, "retries": 0, "seconds": 0.0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, key: str, n=1):
+        with self._stats_lock:
+            self.stats[key] += n
+
+    def _remaining(self):
+        return None if self.deadline is None else self.deadline - time.monotonic()
+
+    def _backoff(self, attempt: int, why: str):
+        if attempt >= MAX_ATTEMPTS - 1:
+            # Last attempt failed: call() gives up now, no point sleeping first.
+            return
+        # Full jitter: uniform over [0, min(cap, base * 2^attempt)].
+        wait = random.uniform(0, min(BACKOFF_CAP, BACKOFF_BASE * (2 ** attempt)))
+        remaining = self._remaining()
+        if remaining is not None and wait >= remaining:
+            raise DeadlineExceeded(f"{why}; no time left to retry")
+        print(f"[lastfm] {why}, retrying in {wait:.1f}s...", flush=True)
+        self._count("retries")
+        time.sleep(wait)
+
+    def call(self, method: str, **params) -> dict:
+        """One API method call, with retries; returns the decoded JSON body."""
+        query = {"method": method, "api_key": self.api_key, "format": "json", **params}
+        last_err = None
+        for attempt in range(MAX_ATTEMPTS):
+            self.bucket.take(self.deadline)
+            timeout = self.timeout
+            remaining = self._remaining()
+            if remaining is not None:
+                if remaining <= 0:
+                    raise DeadlineExceeded("deadline reached before request")
+                timeout = (min(timeout[0], remaining), min(timeout[1], remaining))
+            t0 = time.monotonic()
+            try:
+                r = self.session.get(self.root, params=query, timeout=timeout)
+            except NETWORK_ERRORS as e:
+                r = None
+                last_err = e
+            self._count("requests")
+            self._count("seconds", time.monotonic() - t0)
+            if r is None:
+                self._backoff(attempt, f"network timeout/conn issue ({last_err.__class__.__name__})")
+                continue
+            try:
+                data = r.json()
+            except ValueError as e:
+                last_err = e
+                self._backoff(attempt, f"bad response (HTTP {r.status_code})")
+                continue
+
+            if "error" not in data:
+                return data
+
+            err = int(data.get("error") or 0)
+            msg = data.get("message") or "Unknown error"
+            if err in RETRY_ERRORS:
+                last_err = RuntimeError(f"Last.fm error {err}: {msg}")
+                self._backoff(attempt, f"transient error {err} ('{msg}')")
+                continue
+            raise LastfmError(err, msg)
+
+        raise RuntimeError(f"Last.fm network kept failing after retries: {last_err}")
+
+    def get_similar(self, artist: str, title: str, limit: int) -> list:
+        data = self.call("track.getSimilar", artist=artist, track=title,
+                         limit=str(limit), autocorrect="1")
+        tracks = data.get("similartracks", {}).get("track", [])
+        if isinstance(tracks, dict):
+            tracks = [tracks]
+        return tracks or []
+
+    def close(self):
+        self.session.close()
@@ -1,33 +1,50 @@
 #!/usr/bin/env python3
 import argparse
+import heapq
 import json
 import os
 import random
 import re
+import socket
 import subprocess
+import threading
 import time
 import traceback
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeout
+from contextlib import redirect_stderr, redirect_stdout
 from datetime import datetime
 
-import requests
-from mpd import MPDClient, CommandError
+from mpd import MPDClient, CommandError, ConnectionError as MPDConnectionError
 from mutagen import File as MutagenFile
 
-# Use HTTPS (more reliable than plain HTTP) + retries below
-LASTFM_ROOT = "https://ws.audioscrobbler.com/2.0/"
+from lastfm_cache import SIMILAR_CACHE_MAX, SIMILAR_CACHE_TTL, ResponseArchive, SimilarCache, similar_key
+from lastfm_client import DeadlineExceeded, LastfmClient
+from moode_graph import SimilarGraph
+from moode_index import close_index, load_index, read_header
+from moode_norm import dice, norm, trigrams
+
 LOG_PATH = os.environ.get("VIBE_LOG", "/home/moode/lastfm_vibe_radio.log")
+SIMILAR_CACHE_PATH = os.environ.get("VIBE_SIMILAR_CACHE", "")
+
+# Trigram (approximate) matching: minimum score when enabled (the
+# --approx-threshold default is 0, off), how many of a title's
+# rarest trigrams gather candidates, the total posting-list entries read
+# per lookup, and how many of the most-shared candidates are scored.
+APPROX_THRESHOLD = 0.75
+APPROX_GRAMS = 6
+APPROX_SCAN_BUDGET = 4000
+APPROX_VERIFY = 40
+
+# MPD socket timeout, and the shortest one a --max-seconds run still allows
+# itself after the deadline to flush what it found and start playback.
+MPD_TIMEOUT = 10.0
+MPD_GRACE = 2.0
 
 PAREN_COPY_RE = re.compile(
     r"\s\(\d+\)\.(flac|mp3|m4a|mp4|ogg|oga|opus|wav|aiff|aif)$",
     re.IGNORECASE
 )
 
-TITLE_JUNK = [
-    "album version", "single version", "radio edit", "edit",
-    "remaster", "remastered", "live", "live album version",
-    "mono", "stereo", "bonus track", "deluxe edition", "expanded edition",
-]
-
 # -----------------------------
 # Seasonal / Christmas filter
 # -----------------------------
@@ -71,19 +88,6 @@ def first_str(value) -> str:
     return str(value or "").strip()
 
 
-def norm(s: str) -> str:
-    if not s:
-        return ""
-    s = s.casefold().strip()
-    s = re.sub(r"\s*\(.*?\)\s*", " ", s)
-    s = re.sub(r"\s*\[.*?\]\s*", " ", s)
-    s = re.sub(r"\b(feat|ft)\.?\b.*$", "", s)
-    for junk in TITLE_JUNK:
-        s = s.replace(junk, " ")
-    s = re.sub(r"[^a-z0-9]+", " ", s)
-    return re.sub(r"\s+", " ", s).strip()
-
-
 def track_key(artist: str, title: str) -> str:
     a = norm(artist)
     t = norm(title)
@@ -161,67 +165,110 @@ def mpd_to_abs(mpd_file: str) -> str:
     return f
 
 
-def mpd_connect(host: str, port: int) -> MPDClient:
+def mpd_connect(host: str, port: int, timeout: float = MPD_TIMEOUT) -> MPDClient:
     c = MPDClient()
-    c.timeout = 10
+    c.timeout = timeout
     c.idletimeout = None
     c.connect(host, port)
     return c
 
 
-def lastfm_get_similar(api_key: str, artist: str, title: str, limit: int):
-    params = {
-        "method": "track.getSimilar",
-        "artist": artist,
-        "track": title,
-        "api_key": api_key,
-        "format": "json",
-        "limit": str(limit),
-        "autocorrect": "1",
-    }
+ACK_INDEX_RE = re.compile(r"@(\d+)\]")
+
+
+class QueueWriter:
+    """
+    Batches MPD queue adds into command_ok lists and tracks the queue length
+    locally after one initial status, so loop checks cost no round trips.
+
+    MPD stops a command list at the first failing command; that file is
+    reported back as bad and the rest of the batch is resent.
+
+    A batch (or status) that times out or loses the connection leaves the
+    writer in `error`: later adds are not sent, and `lost` lists the files
+    of that batch (MPD may or may not have taken them) and any still
+    pending.
+    """
 
-    last_err = None
-    for attempt in range(6):  # 6 tries total
+    def __init__(self, mpd, batch_size: int = 10):
+        self.mpd = mpd
+        self.batch_size = max(1, batch_size)
+        self.pending = []
+        self.round_trips = 0
+        self.error = None
+        self.lost = []
+        self.length = 0
+        self.length = self.refresh()
+
+    def refresh(self) -> int:
+        if self.error is not None:
+            return self.length
+        self.round_trips += 1
         try:
-            r = requests.get(
-                LASTFM_ROOT,
-                params=params,
-                timeout=(5, 20),  # (connect timeout, read timeout)
-                headers={"User-Agent": "moode-vibe/chain-2.0"}
-            )
-            data = r.json()
-
-            if "error" not in data:
-                tracks = data.get("similartracks", {}).get("track", [])
-                if isinstance(tracks, dict):
-                    tracks = [tracks]
-                return tracks or []
-
-            err = int(data.get("error") or 0)
-            msg = data.get("message") or "Unknown error"
-
-            # Last.fm transient
-            if err == 8:
-                wait = 1.5 * (attempt + 1)
-                print(f"[lastfm] transient error 8 ('{msg}'), retrying in {wait:.1f}s...", flush=True)
-                time.sleep(wait)
-                continue
+            self.length = int(self.mpd.status().get("playlistlength", "0"))
+        except (OSError, MPDConnectionError) as e:
+            # The reply may still be in flight: the connection is unusable.
+            self.error = e
+            self.lost = self.pending
+            self.pending = []
+        except Exception:
+            self.length = 0
+        return self.length
+
+    def __len__(self) -> int:
+        return self.length + len(self.pending)
+
+    def add(self, mpd_file: str) -> list:
+        """Queue a file; returns [(file, error)] for files rejected by a flush this triggered."""
+        if self.error is not None:
+            self.lost.append(mpd_file)
+            return []
+        self.pending.append(mpd_file)
+        if len(self.pending) >= self.batch_size:
+            return self.flush()
+        return []
+
+    def flush(self) -> list:
+        failed = []
+        while self.pending:
+            batch, self.pending = self.pending, []
+            self.round_trips += 1
+            try:
+                self.mpd.command_list_ok_begin()
+                for f in batch:
+                    self.mpd.add(f)
+                self.mpd.command_list_end()
+                self.length += len(batch)
+            except (OSError, MPDConnectionError) as e:
+                self.error = e
+                self.lost = batch + self.pending
+                self.pending = []
+                break
+            except CommandError as e:
+                msg = str(e)
+                m = ACK_INDEX_RE.search(msg)
+                if not m:
+                    raise
+                # Any ACK naming a command in the list (not found, access
+                # denied, malformed URI, ...) rejects that one file.
+                i = min(int(m.group(1)), len(batch) - 1)
+                self.length += i
+                failed.append((batch[i], msg))
+                self.pending = batch[i + 1:]
+        return failed
 
-            raise RuntimeError(f"Last.fm error {err}: {msg}")
-
-        except (
-            requests.exceptions.ReadTimeout,
-            requests.exceptions.ConnectTimeout,
-            requests.exceptions.Timeout,
-            requests.exceptions.ConnectionError,
-        ) as e:
-            last_err = e
-            wait = 1.5 * (attempt + 1)
-            print(f"[lastfm] network timeout/conn issue ({e.__class__.__name__}), retrying in {wait:.1f}s...", flush=True)
-            time.sleep(wait)
-            continue
 
-    raise RuntimeError(f"Last.fm network kept failing after retries: {last_err}")
+class OfflineMPD:
+    """Stand-in for --replay --dry-run on a machine that can't reach MPD: nothing playing, empty queue."""
+
+    def currentsong(self):
+        return {}
+
+    def status(self):
+        return {}
+
+    def disconnect(self):
+        pass
 
 
 def pick_best(paths, used_files):
@@ -232,7 +279,7 @@ def pick_best(paths, used_files):
     return None
 
 
-def fuzzy_within_artist(text_map: dict, rec_artist: str, rec_title: str):
+def fuzzy_within_artist(text_map: dict, artist_map: dict, rec_artist: str, rec_title: str):
     a = norm(rec_artist)
     t = norm(rec_title)
     if not a or not t:
@@ -245,40 +292,88 @@ def fuzzy_within_artist(text_map: dict, rec_artist: str, rec_title: str):
     t_words = t.split()
     t_prefix = " ".join(t_words[:8]) if len(t_words) > 8 else t
 
+    # Only this artist's titles (artist_map), not every key in the library.
     candidates = []
-    prefix = a + "|"
-    for k, paths in text_map.items():
-        if not k.startswith(prefix):
-            continue
-        _, title_norm = k.split("|", 1)
+    for title_norm in artist_map.get(a) or ():
         if title_norm == t or title_norm.startswith(t_prefix) or t.startswith(title_norm):
-            candidates.extend(paths)
+            candidates.extend(text_map.get(f"{a}|{title_norm}") or ())
 
     return candidates or None
 
 
-def find_seed_file(text_map: dict, artist: str, title: str):
+def approx_matches(trigram_map, artist: str, title: str, k: int = 5,
+                   threshold: float = APPROX_THRESHOLD) -> list:
+    """
+    Closest local "artist|title" keys by trigram similarity, as [(key, score)]
+    best first, score >= threshold. The score is (artist Dice + 2 * title
+    Dice) / 3, so "Beyonce Knowles" finds "Beyoncé" and a track tagged under
+    a collaborator still matches on its title. Candidates come only from the
+    title's rarest few trigrams, so the work does not grow with the library.
+    """
+    a, t = norm(artist), norm(title)
+    t_grams = trigrams(t)
+    if not a or len(t_grams) < 3 or not trigram_map:
+        return []
+    # An mmapped BinaryMap can count and collect postings without decoding them.
+    count = getattr(trigram_map, "count", None)
+    refs = getattr(trigram_map, "refs", None)
+    sized = []
+    for g in t_grams:
+        n = count(g) if count else len(trigram_map.get(g) or ())
+        if n:
+            sized.append((n, g))
+    sized.sort()
+    shared = {}
+    scanned = 0
+    for n, g in sized[:APPROX_GRAMS]:
+        scanned += n
+        if scanned > APPROX_SCAN_BUDGET:
+            break
+        for key in (refs(g) if refs else trigram_map.get(g) or ()):
+            shared[key] = shared.get(key, 0) + 1
+
+    a_grams = trigrams(a)
+    scored = []
+    for key in heapq.nlargest(APPROX_VERIFY, shared, key=shared.get):
+        if refs:
+            key = trigram_map.ref_str(key)
+        ka, _, kt = key.partition("|")
+        score = (dice(a_grams, trigrams(ka)) + 2 * dice(t_grams, trigrams(kt))) / 3
+        if score >= threshold:
+            scored.append((key, round(score, 3)))
+    scored.sort(key=lambda x: (-x[1], x[0]))
+    return scored[:k]
+
+
+def find_seed_file(text_map: dict, artist_map: dict, artist: str, title: str):
     """Best-effort local-library lookup for seed track file path."""
     key = f"{norm(artist)}|{norm(title)}"
     paths = text_map.get(key)
     if paths:
         return sorted(paths, key=path_score)[0]
 
-    paths = fuzzy_within_artist(text_map, artist, title)
+    paths = fuzzy_within_artist(text_map, artist_map, artist, title)
     if paths:
         return sorted(paths, key=path_score)[0]
 
     return None
 
 
-def read_tags(mpd_file: str):
+def read_tags(mpd_file: str, tag_map=None):
     """
     Return (artist, title, album, genre).
     Empty strings if unavailable or unreadable.
+
+    Uses the index's per-file tag record when there is one; only files
+    missing from tag_map are opened with Mutagen.
     """
     if not mpd_file:
         return ("", "", "", "")
 
+    row = tag_map.get(mpd_file) if tag_map else None
+    if row:
+        return (row[0], row[1], row[2], row[3])
+
     # Candidate filesystem paths for this MPD file
     candidates = []
 
@@ -319,7 +414,345 @@ def read_tags(mpd_file: str):
     return ("", "", "", "")
 
 
-def main():
+class TagCache:
+    """
+    Per-run memo of read_tags() results. The same files come up as
+    candidates hop after hop (and again once chosen), and a Mutagen read
+    probes up to three mount paths. prefetch() starts reads for files the
+    index has no tags for on a thread pool; get() waits for an in-flight read.
+
+    `deadline` is a time.monotonic() value (None = no deadline). With one
+    set, file reads go through the pool and get() stops waiting at the
+    deadline (a stalled network mount then yields empty tags instead of
+    hanging the job); past it, files are not opened at all.
+    """
+
+    def __init__(self, tag_map, workers: int = 8, deadline: float = None):
+        self.tag_map = tag_map
+        self.deadline = deadline
+        self._memo = {}
+        self._pool = ThreadPoolExecutor(max_workers=workers) if workers > 0 else None
+        self.stats = {"hits": 0, "index": 0, "file_reads": 0, "prefetched": 0, "deadline_skips": 0}
+
+    def _wait(self, fut):
+        remaining = None if self.deadline is None else max(0.0, self.deadline - time.monotonic())
+        try:
+            return fut.result(timeout=remaining)
+        except FutureTimeout:
+            self.stats["deadline_skips"] += 1
+            return ("", "", "", "")
+        except Exception:
+            return ("", "", "", "")
+
+    def get(self, mpd_file: str):
+        v = self._memo.get(mpd_file)
+        if v is None:
+            if self.tag_map and self.tag_map.get(mpd_file):
+                self.stats["index"] += 1
+                v = read_tags(mpd_file, self.tag_map)
+            elif self.deadline is not None and time.monotonic() >= self.deadline:
+                self.stats["deadline_skips"] += 1
+                v = ("", "", "", "")
+            else:
+                self.stats["file_reads"] += 1
+                if self.deadline is not None and self._pool:
+                    v = self._wait(self._pool.submit(read_tags, mpd_file, None))
+                else:
+                    v = read_tags(mpd_file, self.tag_map)
+        else:
+            self.stats["hits"] += 1
+            if not isinstance(v, tuple):
+                v = self._wait(v)
+        self._memo[mpd_file] = v
+        return v
+
+    def prefetch(self, files):
+        """Start reading tags for files neither memoized nor in the index."""
+        if not self._pool:
+            return
+        for f in files:
+            if not f or f in self._memo or (self.tag_map and self.tag_map.get(f)):
+                continue
+            self._memo[f] = self._pool.submit(read_tags, f, None)
+            self.stats["prefetched"] += 1
+            self.stats["file_reads"] += 1
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+def similar_rec(t: dict):
+    """(artist, title, mbid) of one getSimilar track."""
+    title = (t.get("name") or "").strip()
+    artist = t.get("artist", {})
+    if isinstance(artist, dict):
+        artist = (artist.get("name") or "").strip()
+    else:
+        artist = str(artist).strip()
+    return artist, title, (t.get("mbid") or "").strip().lower()
+
+
+def match_similar(sim, mbid_map: dict, text_map: dict, artist_map: dict,
+                  used_files, used_tracks, include_xmas: bool,
+                  trigram_map=None, approx_threshold: float = 0.0):
+    """
+    Resolve a hop's whole getSimilar list against the index before any guard
+    runs. Each recommendation is normalized once; the MBID lookups come first,
+    then every remaining exact key is resolved with one set intersection
+    against text_map, and only the leftovers go to fuzzy matching (same
+    artist) and then, with approx_threshold > 0, to trigram matching
+    (approx_matches, any artist).
+
+    Returns (rows, stats): rows are (rec_artist, rec_title, cand, method) in
+    sim order, for recommendations with a local file. stats holds the
+    blank / seasonal_rec / already_used_track / no_local_match rejects,
+    per-method counts and per-step times in ms.
+    """
+    stats = {
+        "blank": 0, "seasonal_rec": 0, "already_used_track": 0, "no_local_match": 0,
+        "mbid": 0, "text": 0, "fuzzy": 0, "approx": 0,
+        "normalize_ms": 0.0, "mbid_ms": 0.0, "text_ms": 0.0, "fuzzy_ms": 0.0, "approx_ms": 0.0,
+    }
+
+    t0 = time.perf_counter()
+    recs = []
+    for t in sim:
+        artist, title, mbid = similar_rec(t)
+        if not title or not artist:
+            stats["blank"] += 1
+            continue
+        # Strong seasonal filter at recommendation level
+        if not include_xmas and is_seasonal_text(title, artist):
+            stats["seasonal_rec"] += 1
+            continue
+        a, ti = norm(artist), norm(title)
+        if a and ti and f"{a}|{ti}" in used_tracks:
+            stats["already_used_track"] += 1
+            continue
+        # [artist, title, mbid, text key, cand, method]
+        recs.append([artist, title, mbid, f"{a}|{ti}", None, ""])
+    t1 = time.perf_counter()
+
+    for r in recs:
+        if r[2] and r[2] in mbid_map:
+            r[4] = pick_best(mbid_map[r[2]], used_files)
+            if r[4]:
+                r[5] = "mbid"
+    t2 = time.perf_counter()
+
+    # Set intersection of the distinct keys with text_map, keeping each hit's
+    # paths (one lookup per key, which matters for the mmap'd BinaryMap).
+    hits = {}
+    for key in {r[3] for r in recs if not r[4]}:
+        paths = text_map.get(key)
+        if paths:
+            hits[key] = paths
+    for r in recs:
+        if not r[4] and r[3] in hits:
+            r[4] = pick_best(hits[r[3]], used_files)
+            if r[4]:
+                r[5] = "text"
+    t3 = time.perf_counter()
+
+    for r in recs:
+        if not r[4]:
+            paths = fuzzy_within_artist(text_map, artist_map, r[0], r[1])
+            if paths:
+                r[4] = pick_best(paths, used_files)
+                if r[4]:
+                    r[5] = "fuzzy"
+    t4 = time.perf_counter()
+
+    if approx_threshold > 0 and trigram_map:
+        for r in recs:
+            if r[4]:
+                continue
+            for key, _ in approx_matches(trigram_map, r[0], r[1], threshold=approx_threshold):
+                if key in used_tracks:
+                    continue
+                r[4] = pick_best(text_map.get(key) or (), used_files)
+                if r[4]:
+                    r[5] = "approx"
+                    break
+    t5 = time.perf_counter()
+
+    rows = []
+    for artist, title, _, _, cand, method in recs:
+        if cand:
+            stats[method] += 1
+            rows.append((artist, title, cand, method))
+        else:
+            stats["no_local_match"] += 1
+    for name, dt in (("normalize_ms", t1 - t0), ("mbid_ms", t2 - t1), ("text_ms", t3 - t2),
+                     ("fuzzy_ms", t4 - t3), ("approx_ms", t5 - t4)):
+        stats[name] = round(dt * 1000, 3)
+    return rows, stats
+
+
+# -----------------------------
+# Resident worker (--serve)
+# -----------------------------
+# The Node routes can keep one worker running instead of spawning a Python
+# process per vibe job. Jobs arrive on a Unix socket as one JSON line
+# {"argv": [...CLI args...]}; the job's stdout comes back as {"line": "..."}
+# lines followed by {"exit": code}. Jobs run one at a time on the worker's
+# main thread, reusing the loaded index, the Last.fm session and MPD
+# connections. Closing the socket cancels a job at its next output line.
+
+class VibeWorker:
+    """Warm state shared by the jobs of one --serve process."""
+
+    def __init__(self):
+        self._index = {}
+        self._graph = {}
+        self._lastfm = {}
+        self._mpd = {}
+
+    def index(self, path: str) -> dict:
+        """load_index(path), reloaded only when the index header (or mtime) changes."""
+        hdr = read_header(path)
+        stamp = hdr.get("hash") if hdr else os.path.getmtime(path)
+        cached = self._index.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        lib = load_index(path)
+        if cached:
+            # Jobs run one at a time, so nothing still reads the old maps.
+            close_index(cached[1])
+        self._index[path] = (stamp, lib)
+        return lib
+
+    def graph(self, path: str) -> SimilarGraph:
+        """SimilarGraph(path), reopened when the file is replaced by a new crawl."""
+        stamp = os.path.getmtime(path)
+        cached = self._graph.get(path)
+        if cached and cached[0] == stamp:
+            return cached[1]
+        graph = SimilarGraph(path)
+        if cached:
+            cached[1].close()
+        self._graph[path] = (stamp, graph)
+        return graph
+
+    def lastfm(self, api_key: str, rate: float, pool_size: int) -> LastfmClient:
+        key = (api_key, rate, pool_size)
+        client = self._lastfm.get(key)
+        if client is None:
+            client = self._lastfm[key] = LastfmClient(api_key, rate=rate, pool_size=pool_size)
+        client.deadline = None
+        client.stats = {"requests": 0, "retries": 0, "seconds": 0.0}
+        return client
+
+    def mpd(self, host: str, port: int, timeout: float = MPD_TIMEOUT) -> MPDClient:
+        c = self._mpd.get((host, port))
+        if c is not None:
+            try:
+                c.timeout = timeout
+                c.ping()
+                return c
+            except Exception:
+                self.drop_mpd(host, port)
+        c = self._mpd[(host, port)] = mpd_connect(host, port, timeout)
+        return c
+
+    def drop_mpd(self, host: str = None, port: int = None):
+        """Forget (and close) MPD connections, e.g. after a job failed mid-command."""
+        for key in [k for k in self._mpd if host is None or k == (host, port)]:
+            try:
+                self._mpd.pop(key).disconnect()
+            except Exception:
+                pass
+
+
+class JobOutput:
+    """File-like stdout for a served job: each line goes to the client as JSON."""
+
+    def __init__(self, conn: socket.socket):
+        self.conn = conn
+        self._buf = ""
+        self._lock = threading.Lock()
+
+    def send(self, obj: dict):
+        data = (json.dumps(obj, ensure_ascii=False) + "\n").encode("utf-8")
+        with self._lock:
+            self.conn.sendall(data)
+
+    def write(self, s: str) -> int:
+        with self._lock:
+            self._buf += s
+            lines = self._buf.split("\n")
+            self._buf = lines.pop()
+        for line in lines:
+            self.send({"line": line})
+        return len(s)
+
+    def flush(self):
+        pass
+
+    def close_job(self, code: int):
+        if self._buf:
+            self.send({"line": self._buf})
+            self._buf = ""
+        self.send({"exit": code})
+
+
+def serve_job(conn: socket.socket, worker: VibeWorker):
+    try:
+        with conn.makefile("rb") as f:
+            req = json.loads(f.readline(1 << 20) or b"{}")
+        argv = [str(a) for a in req.get("argv") or []]
+    except ValueError as e:
+        conn.sendall((json.dumps({"line": f"ERROR: bad request: {e}"}) + "\n" + json.dumps({"exit": 2}) + "\n").encode())
+        conn.shutdown(socket.SHUT_WR)
+        return
+    out = JobOutput(conn)
+    t0 = time.monotonic()
+    code = 0
+    try:
+        with redirect_stdout(out), redirect_stderr(out):
+            try:
+                main(argv, worker)
+            except SystemExit as e:
+                if isinstance(e.code, int) or e.code is None:
+                    code = e.code or 0
+                else:
+                    print(e.code)
+                    code = 1
+            except (BrokenPipeError, ConnectionResetError):
+                raise
+            except Exception:
+                log_exc("TRACEBACK")
+                worker.drop_mpd()
+                code = 1
+        out.close_job(code)
+        # EOF after the exit line, for clients that read to the end.
+        conn.shutdown(socket.SHUT_WR)
+    except (BrokenPipeError, ConnectionResetError):
+        # Client went away (job cancelled); the MPD connection may be mid-command.
+        worker.drop_mpd()
+        code = "cancelled"
+    print(f"[serve] job done ({code}) in {time.monotonic() - t0:.2f}s", flush=True)
+
+
+def serve(sock_path: str):
+    worker = VibeWorker()
+    try:
+        os.unlink(sock_path)
+    except FileNotFoundError:
+        pass
+    srv = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    srv.bind(sock_path)
+    os.chmod(sock_path, 0o660)
+    srv.listen(8)
+    print(f"[serve] vibe worker listening on {sock_path}", flush=True)
+    while True:
+        conn, _ = srv.accept()
+        with conn:
+            serve_job(conn, worker)
+
+
+def main(argv=None, worker: VibeWorker = None):
     ap = argparse.ArgumentParser(description="Build a chained Last.fm-based queue in moOde/MPD.")
     ap.add_argument("--api-key", default=os.environ.get("LASTFM_API_KEY", ""))
     ap.add_argument("--index", default="/home/moode/moode_library_index.json")
@@ -351,7 +784,7 @@ def main():
     ap.add_argument("--append", action="store_true",
                     help="Append to existing queue instead of replacing")
     ap.add_argument("--max-seconds", type=int, default=0,
-                    help="Time budget for build; 0 disables")
+                    help="Time budget for the whole job (index load, Last.fm, tag reads, MPD); 0 disables")
     ap.add_argument("--json-out", default="",
                     help="Optional JSON output path")
     ap.add_argument("--debug-trace", action="store_true",
@@ -362,11 +795,102 @@ def main():
                     help="Preview tracks without touching MPD")
     ap.add_argument("--no-final-stop", action="store_true",
                     help="When mode=load, do not send a final stop command")
+    ap.add_argument("--similar-cache", default=SIMILAR_CACHE_PATH,
+                    help="SQLite cache of getSimilar responses (env VIBE_SIMILAR_CACHE; "
+                         "default lastfm_similar_cache.sqlite next to --index)")
+    ap.add_argument("--similar-cache-ttl", type=float,
+                    default=float(os.environ.get("VIBE_SIMILAR_CACHE_TTL", SIMILAR_CACHE_TTL)),
+                    help="Seconds before a cached getSimilar response is refetched; 0 = never expire")
+    ap.add_argument("--similar-cache-max", type=int,
+                    default=int(os.environ.get("VIBE_SIMILAR_CACHE_MAX", SIMILAR_CACHE_MAX)),
+                    help="Cached responses kept (least recently used evicted); 0 = unbounded")
+    ap.add_argument("--no-similar-cache", action="store_true",
+                    help="Always query Last.fm, bypassing the getSimilar cache")
+    ap.add_argument("--prefetch-workers", type=int,
+                    default=int(os.environ.get("VIBE_PREFETCH_WORKERS", "2")),
+                    help="Threads fetching getSimilar for likely next seeds ahead of time; 0 disables")
+    ap.add_argument("--prefetch-per-hop", type=int, default=1,
+                    help="Speculative next-seed prefetches started per hop (besides the chosen track)")
+    ap.add_argument("--add-batch", type=int,
+                    default=int(os.environ.get("VIBE_ADD_BATCH", "10")),
+                    help="Queue adds sent to MPD per command list (1 = one round trip per add)")
+    ap.add_argument("--tag-workers", type=int,
+                    default=int(os.environ.get("VIBE_TAG_WORKERS", "8")),
+                    help="Threads reading candidate tags from files not in the index; 0 = read serially")
+    ap.add_argument("--record", default="", metavar="DIR",
+                    help="Save every getSimilar response used by this run to DIR (for --replay)")
+    ap.add_argument("--replay", default="", metavar="DIR",
+                    help="Serve getSimilar from a --record DIR only; no Last.fm, cache or prefetch")
+    ap.add_argument("--rng-seed", type=int, default=None,
+                    help="Seed shuffle/reseed randomness so runs are reproducible")
+    ap.add_argument("--lastfm-rate", type=float,
+                    default=float(os.environ.get("VIBE_LASTFM_RATE", "4")),
+                    help="Max Last.fm requests started per second, prefetch included; 0 = unlimited")
+    ap.add_argument("--picks-per-hop", type=int,
+                    default=int(os.environ.get("VIBE_PICKS_PER_HOP", "1")),
+                    help="Chained mode: tracks added from one getSimilar list before the next call "
+                         "(extra picks must pass every guard, one per artist)")
+    ap.add_argument("--approx-threshold", type=float,
+                    default=float(os.environ.get("VIBE_APPROX_THRESHOLD", "0")),
+                    help="Trigram match score (0-1) for recommendations no exact/same-artist match finds; "
+                         f"0 (default) disables, {APPROX_THRESHOLD} is a good start")
+    ap.add_argument("--graph", default=os.environ.get("VIBE_GRAPH", ""), metavar="PATH",
+                    help="Similarity graph from build_similar_graph.py; crawled seeds skip Last.fm")
+    ap.add_argument("--graph-only", action="store_true",
+                    help="Use only --graph (no Last.fm, no API key); seeds not in the graph count as empty")
+    ap.add_argument("--start-after", type=int,
+                    default=int(os.environ.get("VIBE_START_AFTER", "0")),
+                    help="With --mode play, start playback once N tracks are queued and keep adding; 0 = play at the end")
+    ap.add_argument("--progress-json", action="store_true",
+                    help="Also print JSON-lines events (start, track, drop, playing, done) on stdout")
+
+    ap.add_argument("--serve", default="", metavar="SOCKET",
+                    help="Run as a resident worker taking jobs (same options) on this Unix socket")
+
+    args = ap.parse_args(argv)
+
+    if args.serve:
+        if worker:
+            raise SystemExit("ERROR: --serve is not valid in a served job")
+        serve(args.serve)
+        return
+    if args.record and args.replay:
+        raise SystemExit("ERROR: --record and --replay are mutually exclusive")
+    if args.replay:
+        args.no_similar_cache = True
+        args.prefetch_workers = 0
+    if args.graph_only and not args.graph:
+        raise SystemExit("ERROR: --graph-only needs --graph")
+    if not args.api_key and not args.replay and not args.graph_only:
+        raise SystemExit("ERROR: Provide Last.fm API key via --api-key or env LASTFM_API_KEY")
 
-    args = ap.parse_args()
+    # One job-wide deadline (time.monotonic()) from --max-seconds, counted
+    # from here so index load and MPD connect come out of the same budget.
+    # Last.fm calls, tag reads, MPD calls and the hop loops all check it.
+    deadline = time.monotonic() + args.max_seconds if args.max_seconds > 0 else None
+    budget = {"hit": False}
 
-    if not args.api_key:
-        raise SystemExit("ERROR: Provide Last.fm API key via --api-key or env LASTFM_API_KEY")
+    def time_left():
+        return None if deadline is None else deadline - time.monotonic()
+
+    def budget_reached(why: str = ""):
+        if not budget["hit"]:
+            print(f"Time budget reached ({args.max_seconds}s){why}, stopping.", flush=True)
+        budget["hit"] = True
+
+    def out_of_time() -> bool:
+        left = time_left()
+        if left is not None and left <= 0:
+            budget_reached()
+            return True
+        return False
+
+    def mpd_timeout() -> float:
+        """MPD socket timeout: what is left of the budget, within [MPD_GRACE, MPD_TIMEOUT]."""
+        left = time_left()
+        return MPD_TIMEOUT if left is None else max(MPD_GRACE, min(MPD_TIMEOUT, left))
+
+    rng = random.Random(args.rng_seed)
 
     env_inc = os.getenv("INCLUDE_CHRISTMAS", "").strip().lower()
     include_xmas = env_inc in ("1", "true", "yes", "y", "on")
@@ -377,25 +901,211 @@ def main():
 
     print(f"[{datetime.now().strftime('%H:%M:%S')}] load index {args.index}", flush=True)
     try:
-        with open(args.index, "r", encoding="utf-8") as f:
-            idx = json.load(f)
-        mbid_map = idx.get("mbid_map", {})
-        text_map = idx.get("text_map", {})
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] index OK: {sum(len(paths) for paths in text_map.values())} text tracks")
+        lib = worker.index(args.index) if worker else load_index(args.index)
+        text_map, mbid_map, artist_map = lib["text_map"], lib["mbid_map"], lib["artist_map"]
+        tag_map = lib["tag_map"]
+        trigram_map = lib["trigram_map"]
+        hdr = lib["header"] or {}
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] index OK: {len(text_map)} text keys ({lib['source']}, "
+              f"schema {hdr.get('schema', '-')}, db_update {hdr.get('db_update') or '-'})")
+    except ValueError as e:
+        # Wrong schema (checked from the header) or a corrupt file: running
+        # on an empty library would only produce a useless queue.
+        print(f"ERROR: index unusable ({args.index}): {e}", flush=True)
+        raise SystemExit(2)
     except Exception as e:
         print(f"[{datetime.now().strftime('%H:%M:%S')}] WARNING index load failed ({args.index}): {e}. Empty library.", flush=True)
         mbid_map = {}
         text_map = {}
+        artist_map = {}
+        tag_map = {}
+        trigram_map = {}
+        hdr = {}
+
+    tags = TagCache(tag_map, args.tag_workers, deadline)
+
+    graph = None
+    if args.graph:
+        try:
+            graph = worker.graph(args.graph) if worker else SimilarGraph(args.graph)
+            g_hash = graph.header["index_hash"]
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] graph OK: {len(graph)} nodes, {graph.n_edges} edges "
+                  f"({args.graph})", flush=True)
+            if g_hash and hdr.get("hash") and g_hash != hdr["hash"]:
+                print("[graph] built against another index version; recrawl to pick up new tracks", flush=True)
+        except (OSError, ValueError) as e:
+            if args.graph_only:
+                raise SystemExit(f"ERROR: cannot open graph {args.graph}: {e}")
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] WARNING graph load failed ({args.graph}): {e}. "
+                  f"Using Last.fm.", flush=True)
+    graph_stats = {"hits": 0, "misses": 0}
+
+    def graph_similar(artist: str, title: str):
+        """A crawled seed's graph edges in getSimilar shape, or None when it was never crawled."""
+        edges = graph.neighbors(track_key(artist, title))
+        if edges is None:
+            return None
+        out = []
+        for target, weight in edges:
+            t_artist, _, t_title = target.partition("|")
+            for p in sorted(text_map.get(target) or (), key=path_score):
+                row = tag_map.get(ensure_mpd_path(p)) if tag_map else None
+                if row and row[0] and row[1]:
+                    t_artist, t_title = row[0], row[1]
+                    break
+            out.append({"name": t_title, "artist": {"name": t_artist}, "match": weight})
+        return out
+
+    similar_cache = None
+    if not args.no_similar_cache:
+        cache_path = args.similar_cache or os.path.join(
+            os.path.dirname(os.path.abspath(args.index)), "lastfm_similar_cache.sqlite")
+        similar_cache = SimilarCache(cache_path, args.similar_cache_ttl, args.similar_cache_max)
+    lastfm_net = {"calls": 0, "seconds": 0.0}
+    if worker:
+        lastfm = worker.lastfm(args.api_key, args.lastfm_rate, args.prefetch_workers + 1)
+    else:
+        lastfm = LastfmClient(args.api_key, rate=args.lastfm_rate, pool_size=args.prefetch_workers + 1)
+    # Retries and rate-limit waits give up instead of overrunning the budget.
+    lastfm.deadline = deadline
+
+    # -----------------------------
+    # Speculative prefetch
+    # -----------------------------
+    # The next seed is the track a hop picks, so its getSimilar can start as
+    # soon as a candidate is known and run while guards, MPD adds and
+    # --sleep happen. Futures are keyed like the cache; workers only do the
+    # network call (the SQLite cache stays on the main thread).
+    prefetch_pool = ThreadPoolExecutor(max_workers=args.prefetch_workers) if args.prefetch_workers > 0 else None
+    prefetched = {}
+    stale = []
+    prefetch_stats = {"started": 0, "used": 0, "wasted": 0, "failed": 0, "waited_s": 0.0}
+
+    def prefetch_call(artist: str, title: str):
+        t0 = time.monotonic()
+        tracks = lastfm.get_similar(artist, title, args.similar_limit)
+        return tracks, time.monotonic() - t0
+
+    def prefetch(artist: str, title: str):
+        key = similar_key(artist, title, args.similar_limit)
+        if not prefetch_pool or not key or key in prefetched:
+            return
+        if graph and (args.graph_only or graph.crawled(track_key(artist, title))):
+            return
+        if similar_cache and similar_cache.contains(artist, title, args.similar_limit):
+            return
+        prefetched[key] = (artist, title, prefetch_pool.submit(prefetch_call, artist, title))
+        prefetch_stats["started"] += 1
+
+    def store_result(artist: str, title: str, tracks: list, seconds: float):
+        lastfm_net["calls"] += 1
+        lastfm_net["seconds"] += seconds
+        if similar_cache:
+            similar_cache.put(artist, title, args.similar_limit, tracks)
+
+    def drain_stale():
+        # Cancel speculation that lost; keep finished responses in the cache.
+        for entry in stale[:]:
+            artist, title, fut = entry
+            if fut.cancel() or fut.done():
+                stale.remove(entry)
+                prefetch_stats["wasted"] += 1
+                if not fut.cancelled() and fut.exception() is None:
+                    store_result(artist, title, *fut.result())
+
+    def fetch_similar(artist: str, title: str):
+        entry = prefetched.pop(similar_key(artist, title, args.similar_limit), None)
+        stale.extend(prefetched.values())
+        prefetched.clear()
+        drain_stale()
+        if entry:
+            t0 = time.monotonic()
+            try:
+                left = time_left()
+                tracks, seconds = entry[2].result(timeout=None if left is None else max(0.0, left))
+            except FutureTimeout:
+                stale.append(entry)
+                raise DeadlineExceeded("prefetched getSimilar still running at the deadline")
+            except Exception as e:
+                prefetch_stats["failed"] += 1
+                print(f"[prefetch] getSimilar failed ({e.__class__.__name__}); fetching again", flush=True)
+            else:
+                waited = time.monotonic() - t0
+                prefetch_stats["used"] += 1
+                prefetch_stats["waited_s"] += waited
+                print(f"[prefetch] getSimilar ready: {artist} - {title} (waited {waited:.2f}s)", flush=True)
+                store_result(artist, title, tracks, seconds)
+                return tracks
+        if similar_cache:
+            tracks = similar_cache.get(artist, title, args.similar_limit)
+            if tracks is not None:
+                print(f"[cache] getSimilar hit: {artist} - {title}", flush=True)
+                return tracks
+        t0 = time.monotonic()
+        tracks = lastfm.get_similar(artist, title, args.similar_limit)
+        store_result(artist, title, tracks, time.monotonic() - t0)
+        return tracks
+
+    recorder = ResponseArchive(args.record) if args.record else None
+    replay = ResponseArchive(args.replay) if args.replay else None
+
+    def get_similar(artist: str, title: str):
+        if graph:
+            tracks = graph_similar(artist, title)
+            if tracks is not None:
+                graph_stats["hits"] += 1
+                return tracks
+            graph_stats["misses"] += 1
+            if args.graph_only:
+                print(f"[graph] {artist} - {title} not in graph; treating as empty", flush=True)
+                return []
+        if replay:
+            tracks = replay.load(artist, title, args.similar_limit)
+            if tracks is None:
+                print(f"[replay] no recorded response for {artist} - {title}; treating as empty", flush=True)
+                return []
+            return tracks
+        tracks = fetch_similar(artist, title)
+        if recorder:
+            recorder.save(artist, title, args.similar_limit, tracks)
+        return tracks
+
+    def finish_prefetch():
+        stale.extend(prefetched.values())
+        prefetched.clear()
+        drain_stale()
+        prefetch_stats["wasted"] += len(stale)
+        if prefetch_pool:
+            prefetch_pool.shutdown(wait=False, cancel_futures=True)
 
     # NOTE: even for preview we still connect to MPD to read current song / playlistinfo.
     print(f"[{datetime.now().strftime('%H:%M:%S')}] STEP: mpd connect {args.host}:{args.port}", flush=True)
-    mpd = mpd_connect(args.host, args.port)
+    try:
+        mpd = (worker.mpd(args.host, args.port, mpd_timeout()) if worker
+               else mpd_connect(args.host, args.port, mpd_timeout()))
+    except (OSError, MPDConnectionError) as e:
+        if not ((args.replay or args.graph_only) and args.dry_run):
+            raise
+        print(f"[offline] MPD unreachable ({e.__class__.__name__}); continuing offline", flush=True)
+        mpd = OfflineMPD()
+    writer = None
+
+    def release_mpd():
+        # A served job leaves the connection open for the next one, unless a
+        # write timed out and left it mid-command.
+        if not worker:
+            mpd.disconnect()
+        elif writer is not None and writer.error is not None:
+            worker.drop_mpd(args.host, args.port)
+
+    def bound_mpd():
+        # Keep each MPD call within the budget (see mpd_timeout).
+        if deadline is not None and not isinstance(mpd, OfflineMPD):
+            mpd.timeout = mpd_timeout()
 
     def queue_len() -> int:
-        try:
-            return int(mpd.status().get("playlistlength", "0"))
-        except Exception:
-            return 0
+        # Tracked locally (see QueueWriter); includes adds not yet flushed.
+        return len(writer)
 
     # Track output for UI/API
     out_tracks = []
@@ -408,20 +1118,30 @@ def main():
     original_seed = (seed_artist, seed_title)
 
     if (seed_artist and not seed_title) or (seed_title and not seed_artist):
-        mpd.disconnect()
+        release_mpd()
         print("ERROR: Provide both --seed-artist and --seed-title (or neither).")
         return
 
-    cur = mpd.currentsong()
+    try:
+        cur = mpd.currentsong()
+    except (OSError, MPDConnectionError) as e:
+        if worker:
+            worker.drop_mpd(args.host, args.port)
+        else:
+            mpd.disconnect()
+        if out_of_time():
+            budget_reached(" waiting for MPD")
+        print(f"ERROR: MPD did not answer ({e.__class__.__name__}: {e})")
+        return
     if not seed_artist and not seed_title:
         if not cur:
-            mpd.disconnect()
+            release_mpd()
             print("Nothing playing and no explicit seed provided.")
             return
         seed_artist = (cur.get("artist") or "").strip()
         seed_title = (cur.get("title") or "").strip()
         if not seed_artist or not seed_title:
-            mpd.disconnect()
+            release_mpd()
             print("Current track missing artist/title.")
             return
 
@@ -440,9 +1160,9 @@ def main():
 
     # If explicit seed wasn't current song, try local lookup to set album context
     if not last_album_k or not last_genre_n:
-        seed_file = find_seed_file(text_map, seed_artist, seed_title)
+        seed_file = find_seed_file(text_map, artist_map, seed_artist, seed_title)
         if seed_file:
-            a0, t0, alb0, g0 = read_tags(seed_file)
+            a0, t0, alb0, g0 = tags.get(seed_file)
             if not last_album_k and alb0:
                 last_album_k = album_key(alb0)
             if not last_genre_n and g0:
@@ -459,13 +1179,20 @@ def main():
     if not args.dry_run and not args.append:
         # Prefer crop (keep now playing) if requested, else clear.
         if args.crop:
-            subprocess.run(["mpc", "-h", args.host, "-p", str(args.port), "crop"], check=False)
+            try:
+                subprocess.run(["mpc", "-h", args.host, "-p", str(args.port), "crop"], check=False,
+                               timeout=mpd_timeout())
+            except subprocess.TimeoutExpired:
+                print("WARN: mpc crop timed out", flush=True)
         else:
             try:
                 mpd.clear()
             except Exception:
                 pass
 
+    bound_mpd()
+    writer = QueueWriter(mpd, args.add_batch)
+
     used_files = set()
     try:
         for item in mpd.playlistinfo():
@@ -503,11 +1230,94 @@ def main():
     misses = 0
     started = time.time()
 
+    # Multi-pick hops (--picks-per-hop): the matched candidate table of the
+    # last getSimilar call, how many more picks it may still give, and the
+    # artist that call was seeded from (seed_artist moves on after a pick).
+    plan_rows = []
+    plan_left = 0
+    batch_artists = set()
+    plan_seed_artist_n = ""
+
+    # Chained picks still waiting in the writer's batch, oldest first, with
+    # the seed/guard state from before each one; a pick MPD rejects at a
+    # later flush lands in dropped_picks and the loop undoes it.
+    pending_picks = []
+    pick_undo = {}
+    dropped_picks = []
+
+    def emit(event: str, **fields):
+        if args.progress_json:
+            print(json.dumps({"event": event, "elapsed_s": round(time.time() - started, 3), **fields},
+                             ensure_ascii=False), flush=True)
+
+    def emit_track(t: dict):
+        emit("track", n=len(out_tracks), **{k: t[k] for k in ("file", "artist", "title", "album", "method")})
+
+    playback = {"started_at": None, "tracks": 0}
+
+    def maybe_start_playback():
+        """--start-after: begin playing as soon as enough of this run's tracks are in MPD."""
+        if (args.dry_run or args.mode != "play" or args.start_after <= 0
+                or playback["started_at"] is not None or len(out_tracks) < args.start_after):
+            return
+        drop_failed(writer.flush())
+        if writer_failed() or len(out_tracks) < args.start_after:
+            return
+        try:
+            if mpd.status().get("state") != "play":
+                mpd.play()
+        except Exception as e:
+            print(f"WARN: early play failed: {e}", flush=True)
+            return
+        playback["started_at"] = round(time.time() - started, 3)
+        playback["tracks"] = len(out_tracks)
+        print(f"[{datetime.now().strftime('%H:%M:%S')}] playback started after {len(out_tracks)} track(s); "
+              f"still adding", flush=True)
+        emit("playing", n=len(out_tracks), queue=queue_len())
+
+    emit("start", seed_artist=seed_artist, seed_title=seed_title, target=args.target_queue,
+         mode=args.mode, dry_run=bool(args.dry_run), start_after=args.start_after)
+
     # IMPORTANT: in dry-run, we do NOT rely on live MPD queue_len() because we are not modifying it.
     # We instead build up out_tracks to args.target_queue.
+    def drop_failed(failed) -> int:
+        """Undo adds MPD rejected in a flushed batch; returns how many were dropped."""
+        for f, msg in failed:
+            bad_files.add(f)
+            used_files.discard(f)
+            out_tracks[:] = [t for t in out_tracks if t["file"] != f]
+            if f in pick_undo:
+                dropped_picks.append(f)
+            print(f"SKIP (MPD can't add): {f} ({msg})", flush=True)
+            emit("drop", file=f, error=str(msg))
+        return len(failed)
+
+    mpd_failure = {"error": None}
+
+    def writer_failed() -> bool:
+        """True once an MPD write timed out or lost the connection; drops the unconfirmed tracks."""
+        if writer.error is None:
+            return False
+        if mpd_failure["error"] is None:
+            mpd_failure["error"] = f"{writer.error.__class__.__name__}: {writer.error}"
+            print(f"WARN: MPD write failed ({mpd_failure['error']}); stopping with what is queued", flush=True)
+            left = time_left()
+            if left is not None and left <= 0:
+                budget_reached(" during an MPD write")
+        lost = set(writer.lost)
+        writer.lost = []
+        for f in lost:
+            used_files.discard(f)
+            emit("drop", file=f, error=mpd_failure["error"])
+        out_tracks[:] = [t for t in out_tracks if t["file"] not in lost]
+        return True
+
     def have_enough() -> bool:
         if args.dry_run:
             return len(out_tracks) >= args.target_queue
+        if queue_len() >= args.target_queue and writer.pending:
+            # Confirm the pending batch before declaring the queue full.
+            drop_failed(writer.flush())
         return queue_len() >= args.target_queue
 
     if args.simple_seed_pass:
@@ -516,22 +1326,29 @@ def main():
         simple_pass = 0
 
         while not have_enough():
+            if out_of_time() or writer_failed():
+                break
+            bound_mpd()
             simple_pass += 1
             batch_added = 0
             pass_seed_artist, pass_seed_title = seed_artist, seed_title
 
             print(f"[{datetime.now().strftime('%H:%M:%S')}] SIMPLE pass {simple_pass}: seed {pass_seed_title} — {pass_seed_artist}", flush=True)
             print(f"[{datetime.now().strftime('%H:%M:%S')}] Last.fm get similar {pass_seed_artist} - {pass_seed_title} limit {args.similar_limit}", flush=True)
-            sim = lastfm_get_similar(args.api_key, pass_seed_artist, pass_seed_title, args.similar_limit)
+            try:
+                sim = get_similar(pass_seed_artist, pass_seed_title)
+            except DeadlineExceeded as e:
+                budget_reached(f" during Last.fm call: {e}")
+                break
             if args.shuffle_top and args.shuffle_top > 0 and sim:
                 n = min(args.shuffle_top, len(sim))
                 head = sim[:n]
                 tail = sim[n:]
-                random.shuffle(head)
+                rng.shuffle(head)
                 sim = head + tail
 
             for t in sim:
-                if have_enough() or batch_added >= simple_batch:
+                if have_enough() or batch_added >= simple_batch or out_of_time():
                     break
 
                 rec_title = (t.get("name") or "").strip()
@@ -558,17 +1375,25 @@ def main():
                         if cand:
                             method = "text"
                 if not cand:
-                    paths = fuzzy_within_artist(text_map, rec_artist, rec_title)
+                    paths = fuzzy_within_artist(text_map, artist_map, rec_artist, rec_title)
                     if paths:
                         cand = pick_best(paths, used_files)
                         if cand:
                             method = "fuzzy"
+                if not cand and args.approx_threshold > 0:
+                    for key, _ in approx_matches(trigram_map, rec_artist, rec_title,
+                                                 threshold=args.approx_threshold):
+                        if key not in used_tracks:
+                            cand = pick_best(text_map.get(key) or (), used_files)
+                            if cand:
+                                method = "approx"
+                                break
                 if not cand:
                     continue
                 if cand in bad_files or cand in used_files:
                     continue
 
-                a2, t2, alb2, g2 = read_tags(cand)
+                a2, t2, alb2, g2 = tags.get(cand)
                 out_tracks.append({
                     "file": cand,
                     "artist": a2 or rec_artist,
@@ -579,12 +1404,6 @@ def main():
                     "rec_artist": rec_artist,
                     "rec_title": rec_title,
                 })
-                if not args.dry_run:
-                    try:
-                        mpd.add(cand)
-                    except Exception:
-                        bad_files.add(cand)
-                        continue
                 used_files.add(cand)
                 kx = track_key(rec_artist, rec_title)
                 if kx:
@@ -595,28 +1414,68 @@ def main():
                 seed_title = t2 or rec_title
                 batch_added += 1
                 print(f"[simple] Added: {rec_title} — {rec_artist} ({method})")
+                emit_track(out_tracks[-1])
+                if not args.dry_run:
+                    batch_added -= drop_failed(writer.add(cand))
+                    maybe_start_playback()
+
+            if not args.dry_run:
+                batch_added -= drop_failed(writer.flush())
 
             print(f"[simple] pass {simple_pass} added {batch_added} track(s)")
+            if budget["hit"] or writer.error is not None:
+                break
             if batch_added <= 0:
                 print(f"[simple] no additions in pass {simple_pass}; stopping to avoid loop")
                 break
 
     while not args.simple_seed_pass and not have_enough():
-        if args.max_seconds > 0 and (time.time() - started) >= args.max_seconds:
-            print(f"Time budget reached ({args.max_seconds}s), stopping.")
+        if out_of_time() or writer_failed():
             break
+        bound_mpd()
+
+        if dropped_picks:
+            # Newest first: the last pending pick's "before" is the state
+            # to return to; an earlier one hands its "before" to the next.
+            for f in sorted(dropped_picks, key=pending_picks.index, reverse=True):
+                undo = pick_undo.pop(f)
+                i = pending_picks.index(f)
+                if i == len(pending_picks) - 1:
+                    (seed_artist, seed_title, last_album_k, recent_album_keys,
+                     last_added_artist_n, last_added_genres) = undo["before"]
+                else:
+                    pick_undo[pending_picks[i + 1]]["before"] = undo["before"]
+                del pending_picks[i]
+                used_tracks.discard(undo["key"])
+                added_seed_history = [s for s in added_seed_history if s is not undo["seed"]]
+                misses += 1
+            dropped_picks.clear()
+            if misses >= args.max_misses:
+                break
+        for f in [f for f in pending_picks if f not in writer.pending]:
+            # Flushed and accepted: final.
+            pending_picks.remove(f)
+            del pick_undo[f]
+
+        # Another pick from the current hop's list, guarded against the
+        # tracks just added; otherwise a new hop (getSimilar call).
+        reuse = plan_left > 0 and bool(plan_rows)
+        if not reuse:
+            hops += 1
+
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] Last.fm get similar {seed_artist} - {seed_title} limit {args.similar_limit}", flush=True)
+            try:
+                sim = get_similar(seed_artist, seed_title)
+            except DeadlineExceeded as e:
+                budget_reached(f" during Last.fm call: {e}")
+                break
 
-        hops += 1
-
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] Last.fm get similar {seed_artist} - {seed_title} limit {args.similar_limit}", flush=True)
-        sim = lastfm_get_similar(args.api_key, seed_artist, seed_title, args.similar_limit)
-
-        if args.shuffle_top and args.shuffle_top > 0 and sim:
-            n = min(args.shuffle_top, len(sim))
-            head = sim[:n]
-            tail = sim[n:]
-            random.shuffle(head)
-            sim = head + tail
+            if args.shuffle_top and args.shuffle_top > 0 and sim:
+                n = min(args.shuffle_top, len(sim))
+                head = sim[:n]
+                tail = sim[n:]
+                rng.shuffle(head)
+                sim = head + tail
 
         chosen_file = None
         chosen_label = ""
@@ -631,8 +1490,17 @@ def main():
         fallback_cross_genre = None
         fallback_seed_genre = None
 
-        print(f"[{datetime.now().strftime('%H:%M:%S')}] pick from {len(sim)} similar", flush=True)
-        if args.debug_trace:
+        if reuse:
+            plan_left -= 1
+            rows = [r for r in plan_rows
+                    if r[2] not in used_files and track_key(r[0], r[1]) not in used_tracks]
+            plan_rows = rows
+            match_stats = {k: 0 for k in ("blank", "seasonal_rec", "already_used_track", "no_local_match",
+                                          "mbid", "text", "fuzzy", "approx")}
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] pick again from {len(rows)} candidates", flush=True)
+        else:
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] pick from {len(sim)} similar", flush=True)
+        if args.debug_trace and not reuse:
             sample = []
             for tt in sim[:12]:
                 s_title = str((tt.get("name") or "")).strip()
@@ -642,11 +1510,19 @@ def main():
                 sample.append({"artist": s_artist, "title": s_title, "mbid": s_mbid})
             print(f"[hop {hops}] similar sample: {json.dumps(sample, ensure_ascii=False)}", flush=True)
 
+        if not reuse:
+            rows, match_stats = match_similar(sim, mbid_map, text_map, artist_map,
+                                              used_files, used_tracks, include_xmas,
+                                              trigram_map, args.approx_threshold)
+            plan_rows = rows
+            plan_left = max(1, args.picks_per_hop) - 1
+            batch_artists = set()
+            plan_seed_artist_n = norm(seed_artist)
         reject = {
-            "blank": 0,
-            "seasonal_rec": 0,
-            "already_used_track": 0,
-            "no_local_match": 0,
+            "blank": match_stats["blank"],
+            "seasonal_rec": match_stats["seasonal_rec"],
+            "already_used_track": match_stats["already_used_track"],
+            "no_local_match": match_stats["no_local_match"],
             "bad_file": 0,
             "seasonal_local": 0,
             "same_album": 0,
@@ -655,71 +1531,23 @@ def main():
             "cross_genre_disjoint": 0,
             "seed_artist_guard": 0,
             "repeat_artist_guard": 0,
+            "batch_artist": 0,
         }
-        match_method_counts = {"mbid": 0, "text": 0, "fuzzy": 0}
+        match_method_counts = {m: match_stats[m] for m in ("mbid", "text", "fuzzy", "approx")}
+        # Extra picks seed nothing new until the batch ends.
+        hop_prefetches = args.prefetch_per_hop if reuse else 0
 
-        for t in sim:
-            rec_title = (t.get("name") or "").strip()
-            rec_artist = t.get("artist", {})
-            if isinstance(rec_artist, dict):
-                rec_artist = (rec_artist.get("name") or "").strip()
-            else:
-                rec_artist = str(rec_artist).strip()
-            rec_mbid = (t.get("mbid") or "").strip().lower()
-
-            if not rec_title or not rec_artist:
-                reject["blank"] += 1
-                continue
-
-            # Strong seasonal filter at recommendation level
-            if not include_xmas and is_seasonal_text(rec_title, rec_artist):
-                reject["seasonal_rec"] += 1
-                continue
-
-            rk = track_key(rec_artist, rec_title)
-            if rk and rk in used_tracks:
-                reject["already_used_track"] += 1
-                continue
-
-            cand = None
-            method = ""
-
-            # 1) MBID map
-            if rec_mbid and rec_mbid in mbid_map:
-                cand = pick_best(mbid_map[rec_mbid], used_files)
-                if cand:
-                    method = "mbid"
-                    match_method_counts["mbid"] += 1
-
-            # 2) exact text map
-            if not cand:
-                key = f"{norm(rec_artist)}|{norm(rec_title)}"
-                paths = text_map.get(key)
-                if paths:
-                    cand = pick_best(paths, used_files)
-                    if cand:
-                        method = "text"
-                        match_method_counts["text"] += 1
-
-            # 3) fuzzy within artist
-            if not cand:
-                paths = fuzzy_within_artist(text_map, rec_artist, rec_title)
-                if paths:
-                    cand = pick_best(paths, used_files)
-                    if cand:
-                        method = "fuzzy"
-                        match_method_counts["fuzzy"] += 1
-
-            if not cand:
-                reject["no_local_match"] += 1
-                continue
+        # Read the candidates' tags in one parallel burst before the guard
+        # chain asks for them one at a time.
+        tags.prefetch(cand for _, _, cand, _ in rows)
 
+        for rec_artist, rec_title, cand, method in rows:
             if cand in bad_files:
                 reject["bad_file"] += 1
                 continue
 
             # Strong seasonal filter at local file/tag level
-            a_tag, t_tag, alb_tag, g_tag = read_tags(cand)
+            a_tag, t_tag, alb_tag, g_tag = tags.get(cand)
             if not include_xmas:
                 if is_seasonal_text(cand):
                     reject["seasonal_local"] += 1
@@ -728,6 +1556,15 @@ def main():
                     reject["seasonal_local"] += 1
                     continue
 
+            # Early candidates usually win (or become the fallback): start
+            # their getSimilar now, as the next hop will seed from them.
+            if hop_prefetches < args.prefetch_per_hop:
+                hop_prefetches += 1
+                if a_tag and t_tag:
+                    prefetch(a_tag, t_tag)
+                else:
+                    prefetch(rec_artist, rec_title)
+
             # same-album guard
             if cand not in album_cache:
                 album_cache[cand] = album_key(alb_tag)
@@ -761,12 +1598,17 @@ def main():
             cand_artist_n = norm(a_tag or rec_artist)
 
             # Strong preference on first added hop: branch to a different artist than the seed.
-            if hops == 1 and cand_artist_n and cand_artist_n == norm(seed_artist):
+            if hops == 1 and cand_artist_n and cand_artist_n == plan_seed_artist_n:
                 if fallback_seed_artist is None:
                     fallback_seed_artist = (cand, method, rec_title, rec_artist, cand_album_k)
                 reject["seed_artist_guard"] += 1
                 continue
 
+            if reuse and cand_artist_n in batch_artists:
+                # One track per artist from a single similar list.
+                reject["batch_artist"] += 1
+                continue
+
             if last_added_artist_n and cand_artist_n and cand_artist_n == last_added_artist_n:
                 # Soft guard: avoid back-to-back same artist when possible.
                 if fallback_repeat is None:
@@ -782,6 +1624,12 @@ def main():
             chosen_album_k = cand_album_k
             break
 
+        if reuse:
+            # Extra picks take clean candidates only; the fallbacks below
+            # exist to avoid a miss on a fresh hop.
+            fallback_repeat = fallback_recent_album = fallback_same_album = None
+            fallback_seed_genre = fallback_cross_genre = None
+
         if not chosen_file and fallback_repeat is not None:
             cand, method, rec_title, rec_artist, cand_album_k = fallback_repeat
             chosen_file = cand
@@ -831,7 +1679,16 @@ def main():
         # If no cross-artist candidate can be added, treat as miss and reseed.
 
         if args.debug_trace:
-            print(f"[hop {hops}] match summary: methods={json.dumps(match_method_counts)} rejects={json.dumps(reject)} chosen={'yes' if chosen_file else 'no'}", flush=True)
+            timing = {k: v for k, v in match_stats.items() if k.endswith("_ms")}
+            print(f"[hop {hops}] match summary: recs={len(sim)} candidates={len(rows)} methods={json.dumps(match_method_counts)} "
+                  f"match_ms={json.dumps(timing)} rejects={json.dumps(reject)} chosen={'yes' if chosen_file else 'no'}", flush=True)
+
+        if not chosen_file and reuse:
+            # Batch exhausted: next iteration is a new hop from the last pick,
+            # whose getSimilar was not prefetched while picks remained.
+            plan_left = 0
+            prefetch(seed_artist, seed_title)
+            continue
 
         if not chosen_file:
             misses += 1
@@ -852,7 +1709,7 @@ def main():
                         print(f"[hop {hops}] No add (miss {misses}/{args.max_misses}). No alternate reseed candidates.")
                 else:
                     if args.reseed_random:
-                        new_seed = random.choice(window)
+                        new_seed = rng.choice(window)
                     else:
                         idx_back = min(reseed_cursor, len(window) - 1)
                         new_seed = window[-1 - idx_back]
@@ -870,7 +1727,13 @@ def main():
             continue
 
         # Record for UI/API (always)
-        a2, t2, alb2, g2 = read_tags(chosen_file)
+        a2, t2, alb2, g2 = tags.get(chosen_file)
+        if plan_left <= 0:
+            # Last pick of this hop: it seeds the next getSimilar.
+            if a2 and t2:
+                prefetch(a2, t2)
+            else:
+                prefetch(chosen_rec_artist, chosen_rec_title)
         out_tracks.append({
             "file": chosen_file,
             "artist": a2 or chosen_rec_artist,
@@ -884,24 +1747,23 @@ def main():
 
         # Actually add to MPD only when not dry-run
         if not args.dry_run:
-            try:
-                print(f"[{datetime.now().strftime('%H:%M:%S')}] added {chosen_label} ({chosen_method}) file {chosen_file}", flush=True)
-                mpd.add(chosen_file)
-            except CommandError as e:
-                msg = str(e)
-                if "No such directory" in msg or "Not found" in msg:
-                    bad_files.add(chosen_file)
-                    print(f"[hop {hops}] SKIP (MPD can't add): {chosen_label} -> {chosen_file} ({msg})")
-                    misses += 1
-                    if misses >= args.max_misses:
-                        break
-                    continue
-                raise
+            print(f"[{datetime.now().strftime('%H:%M:%S')}] added {chosen_label} ({chosen_method}) file {chosen_file}", flush=True)
+            drop_failed(writer.add(chosen_file))
+            if chosen_file in bad_files:
+                # Rejected in the batch this add flushed.
+                misses += 1
+                if misses >= args.max_misses:
+                    break
+                continue
             print(f"[{datetime.now().strftime('%H:%M:%S')}] queue len {queue_len()}", flush=True)
 
         used_files.add(chosen_file)
         misses = 0
         reseed_cursor = 0
+        undo = None
+        if chosen_file in writer.pending:
+            undo = {"before": (seed_artist, seed_title, last_album_k, list(recent_album_keys),
+                               last_added_artist_n, set(last_added_genres))}
 
         # Next hop seed from actual local tags when possible
         if a2 and t2:
@@ -926,37 +1788,55 @@ def main():
             recent_album_keys = dedup[:album_rotate_window]
 
         last_added_artist_n = norm(a2 or chosen_rec_artist)
+        batch_artists.add(last_added_artist_n)
         if g2:
             gs = genre_tokens(g2)
             if gs:
                 last_added_genres = gs
 
         k2 = track_key(seed_artist, seed_title)
+        if undo:
+            undo["key"] = k2 if k2 not in used_tracks else ""
         if k2:
             used_tracks.add(k2)
 
         added_seed_history.append((seed_artist, seed_title))
+        if undo:
+            undo["seed"] = added_seed_history[-1]
+            pick_undo[chosen_file] = undo
+            pending_picks.append(chosen_file)
 
         print(f"[hop {hops}] Added: {chosen_label} ({chosen_method})")
+        emit_track(out_tracks[-1])
         if not args.dry_run:
             print(f"Queue length now: {queue_len()}")
+            maybe_start_playback()
 
         if args.sleep > 0:
-            time.sleep(args.sleep)
+            left = time_left()
+            time.sleep(args.sleep if left is None else max(0.0, min(args.sleep, left)))
 
-    # Final state (do not stop/play in dry-run)
+    finish_prefetch()
+    if not args.dry_run:
+        bound_mpd()
+        drop_failed(writer.flush())
+        writer_failed()
+
+    # Final state (do not stop/play in dry-run). After a failed write the
+    # connection may be mid-command, so it is left alone.
     final_state = "unknown"
-    try:
-        final_state = mpd.status().get("state", "unknown")
-    except Exception:
-        pass
+    if writer.error is None:
+        try:
+            final_state = mpd.status().get("state", "unknown")
+        except Exception:
+            pass
 
-    final_len = queue_len()
+    final_len = writer.refresh()
     if args.dry_run:
         final_len = len(out_tracks)
 
-    if not args.dry_run:
-        if args.mode == "play":
+    if not args.dry_run and writer.error is None:
+        if args.mode == "play" and playback["started_at"] is None:
             try:
                 mpd.play()
             except Exception:
@@ -982,6 +1862,25 @@ def main():
         "dry_run": bool(args.dry_run),
         "crop": bool(args.crop),
         "tracks": out_tracks,
+        "similar_cache": similar_cache.summary() if similar_cache else {"disabled": True},
+        "prefetch": {**prefetch_stats, "waited_s": round(prefetch_stats["waited_s"], 3),
+                     "workers": args.prefetch_workers},
+        "lastfm_calls": lastfm_net["calls"],
+        "lastfm_seconds": round(lastfm_net["seconds"], 3),
+        "tags": tags.stats,
+        "mpd_queue_round_trips": writer.round_trips,
+        "rng_seed": args.rng_seed,
+        "record": {"dir": args.record, **recorder.stats} if recorder else None,
+        "replay": {"dir": args.replay, **replay.stats} if replay else None,
+        "lastfm_requests": lastfm.stats["requests"],
+        "lastfm_retries": lastfm.stats["retries"],
+        "graph": {"path": args.graph, **graph_stats} if graph else None,
+        "start_after": args.start_after,
+        "playback_started_s": playback["started_at"],
+        "playback_started_tracks": playback["tracks"],
+        "max_seconds": args.max_seconds,
+        "deadline_hit": budget["hit"],
+        "mpd_error": mpd_failure["error"],
     }
 
     if args.json_out:
@@ -991,8 +1890,24 @@ def main():
         except Exception:
             print(f"WARN: failed writing json output to {args.json_out}")
 
+    if prefetch_pool:
+        print(f"[prefetch] started {prefetch_stats['started']} used {prefetch_stats['used']} "
+              f"wasted {prefetch_stats['wasted']} failed {prefetch_stats['failed']}", flush=True)
+    if similar_cache:
+        st = similar_cache.stats
+        print(f"[cache] getSimilar hits {st['hits']} misses {st['misses']} | "
+              f"Last.fm {lastfm_net['calls']} call(s) {lastfm_net['seconds']:.2f}s", flush=True)
     print(f"[{datetime.now().strftime('%H:%M:%S')}] final queue {final_len}", flush=True)
-    mpd.disconnect()
+    if similar_cache:
+        similar_cache.close()
+    if not worker:
+        lastfm.close()
+        if graph:
+            graph.close()
+    tags.close()
+    release_mpd()
+    emit("done", final_queue=final_len, tracks=len(out_tracks), state=final_state, hops=hops,
+         playback_started_s=playback["started_at"], deadline_hit=budget["hit"])
     print(f"Done. Final queue length: {final_len} | mode={args.mode} | state={final_state} | dry_run={args.dry_run}")
 
 
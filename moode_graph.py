@@ -0,0 +1,152 @@
+"""
+Local-only similarity graph for lastfm_vibe_radio.py, written by
+build_similar_graph.py.
+
+Nodes are index text keys ("norm(artist)|norm(title)", as in text_map), so the
+graph survives files being moved or re-tagged with the same names. Each
+crawled node keeps only the getSimilar edges that land on another track in
+the library, with Last.fm's match score as the weight. A vibe run then chains
+hops over the graph without the network.
+
+Binary layout (little-endian), mmapped by SimilarGraph:
+
+    header   magic "NPSIMGRF", version u16, reserved u16, n_nodes u32,
+             n_edges u32, reserved u32, nodes_off u64, edges_off u64,
+             pool_off u64, pool_len u64, created u64, index_hash 16s
+    nodes    sorted by key bytes:
+             (key_off u32, key_len u32, edge_start u32, edge_count u16, flags u16)
+    edges    per node, strongest first: (target node u32, weight u16 = match * 65535)
+    pool     UTF-8 keys; offsets above are relative to pool_off
+
+flags bit 0 marks a crawled node (a crawled node with no edges had no local
+matches; an uncrawled one is only known as an edge target).
+"""
+import mmap
+import os
+import struct
+import time
+
+GRAPH_MAGIC = b"NPSIMGRF"
+GRAPH_VERSION = 1
+
+GRAPH_HEADER = struct.Struct("<8sHHIIIQQQQQ16s")
+NODE = struct.Struct("<IIIHH")
+EDGE = struct.Struct("<IH")
+
+NODE_CRAWLED = 1
+MAX_EDGES = 0xFFFF
+WEIGHT_SCALE = 0xFFFF
+
+
+def graph_path_for(index_path: str) -> str:
+    return os.path.join(os.path.dirname(os.path.abspath(index_path)), "moode_similar_graph.bin")
+
+
+def write_graph(path: str, adjacency: dict, index_hash: str = ""):
+    """
+    Write {key: [(target_key, weight), ...]} (crawled nodes only) atomically
+    to `path`. Targets that were never crawled become edge-only nodes.
+    """
+    keys = set(adjacency)
+    for edges in adjacency.values():
+        keys.update(t for t, _ in edges)
+    keys = sorted(keys, key=lambda k: k.encode("utf-8"))
+    ids = {k: i for i, k in enumerate(keys)}
+
+    pool = bytearray()
+    node_rows = bytearray()
+    edge_rows = bytearray()
+    n_edges = 0
+    for k in keys:
+        b = k.encode("utf-8")
+        edges = sorted(adjacency.get(k) or (), key=lambda e: -e[1])[:MAX_EDGES]
+        flags = NODE_CRAWLED if k in adjacency else 0
+        node_rows += NODE.pack(len(pool), len(b), n_edges, len(edges), flags)
+        pool += b
+        for target, weight in edges:
+            w = min(WEIGHT_SCALE, max(0, int(round(float(weight) * WEIGHT_SCALE))))
+            edge_rows += EDGE.pack(ids[target], w)
+        n_edges += len(edges)
+
+    nodes_off = GRAPH_HEADER.size
+    edges_off = nodes_off + len(node_rows)
+    pool_off = edges_off + len(edge_rows)
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(GRAPH_HEADER.pack(
+            GRAPH_MAGIC, GRAPH_VERSION, 0, len(keys), n_edges, 0,
+            nodes_off, edges_off, pool_off, len(pool), int(time.time()),
+            bytes.fromhex(index_hash or "").ljust(16, b"\0")[:16],
+        ))
+        f.write(node_rows)
+        f.write(edge_rows)
+        f.write(pool)
+    os.replace(tmp, path)
+
+
+class SimilarGraph:
+    """An open, mmapped similarity graph. neighbors() binary-searches the node table."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        (magic, version, _, self._n, self.n_edges, _, self._nodes_off, self._edges_off,
+         self._pool_off, _, created, index_hash) = GRAPH_HEADER.unpack_from(self._mm, 0)
+        if magic != GRAPH_MAGIC or version != GRAPH_VERSION:
+            self._mm.close()
+            raise ValueError(f"not a v{GRAPH_VERSION} similarity graph: {path}")
+        self.header = {
+            "nodes": self._n,
+            "edges": self.n_edges,
+            "created": created,
+            "index_hash": index_hash.hex() if index_hash.strip(b"\0") else "",
+        }
+
+    def _node(self, i: int):
+        return NODE.unpack_from(self._mm, self._nodes_off + i * NODE.size)
+
+    def _key(self, k_off: int, k_len: int) -> bytes:
+        start = self._pool_off + k_off
+        return self._mm[start:start + k_len]
+
+    def _find(self, key: str) -> int:
+        target = key.encode("utf-8")
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            k_off, k_len, _, _, _ = self._node(mid)
+            if self._key(k_off, k_len) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n:
+            k_off, k_len, _, _, _ = self._node(lo)
+            if self._key(k_off, k_len) == target:
+                return lo
+        return -1
+
+    def crawled(self, key: str) -> bool:
+        i = self._find(key)
+        return i >= 0 and bool(self._node(i)[4] & NODE_CRAWLED)
+
+    def neighbors(self, key: str):
+        """[(target_key, weight)] strongest first, or None when `key` was never crawled."""
+        i = self._find(key)
+        if i < 0:
+            return None
+        _, _, start, count, flags = self._node(i)
+        if not flags & NODE_CRAWLED:
+            return None
+        out = []
+        for j in range(start, start + count):
+            target, w = EDGE.unpack_from(self._mm, self._edges_off + j * EDGE.size)
+            k_off, k_len, _, _, _ = self._node(target)
+            out.append((self._key(k_off, k_len).decode("utf-8"), w / WEIGHT_SCALE))
+        return out
+
+    def __len__(self):
+        return self._n
+
+    def close(self):
+        self._mm.close()
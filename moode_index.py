@@ -0,0 +1,535 @@
+"""
+On-disk formats for moode_library_index, shared by build_moode_index.py
+(writer) and lastfm_vibe_radio.py (reader).
+
+moode_library_index.json stays the primary output and export format. The
+optional binary form (moode_library_index.bin) holds the same
+key -> [paths] maps as sorted key tables over one string pool, so a vibe job
+can mmap it and binary-search keys without parsing or building dicts.
+
+Both formats start with a small header (schema, builder version, MPD
+db_update, file count, content hash) that read_header() returns from the
+first JSON_HEADER_BYTES / HEADER.size bytes, so consumers can validate or
+skip an index without loading it. The JSON header is the first member,
+space-padded to a fixed size:
+
+    {"header": {"schema": 5, ...}<spaces>, "text_map": ..., "meta": {...}}
+
+The header's "lazy" member gives the byte span of each LAZY_SECTIONS
+value; load_index() parses the rest and decodes those on first use.
+
+Binary layout (little-endian):
+
+    header   magic "NPIDXBIN", version u16, n_tables u16, reserved u32,
+             pool_off u64, pool_len u64, schema u16, reserved u16,
+             files u32, db_update u64, hash 16s, builder 16s
+    tables   n_tables x (name 16s, n_keys u32, keys_off u64,
+                         n_paths u32, paths_off u64)
+    keys     per table, sorted by key bytes:
+             (key_off u32, key_len u32, path_start u32, path_count u32)
+    paths    per table: (path_off u32, path_len u32)
+    pool     UTF-8 strings; offsets above are relative to pool_off
+"""
+import hashlib
+import json
+import mmap
+import os
+import struct
+from collections.abc import Mapping
+
+from moode_norm import trigrams
+
+# Bump when the index layout or per-file record shape changes; builders
+# rescan and readers refuse indexes with another schema.
+INDEX_SCHEMA = 5
+
+JSON_HEADER_BYTES = 512
+JSON_HEADER_PREFIX = b'{"header": '
+
+# Large JSON sections a vibe job may never touch (per-file tag records,
+# approximate matching).
+LAZY_SECTIONS = ("files", "trigram_map")
+
+BIN_MAGIC = b"NPIDXBIN"
+BIN_VERSION = 2
+
+HEADER = struct.Struct("<8sHHIQQHHIQ16s16s")
+TABLE = struct.Struct("<16sIQIQ")
+KEY = struct.Struct("<IIII")
+PATH = struct.Struct("<II")
+
+
+def build_artist_map(keys) -> dict:
+    """
+    Secondary index: normalized artist -> sorted normalized titles, built from
+    "artist|title" text_map keys. Lets fuzzy matching scan one artist's
+    catalogue instead of every key in the library.
+    """
+    artist_map = {}
+    for k in keys:
+        a, sep, t = k.partition("|")
+        if sep and a and t:
+            artist_map.setdefault(a, []).append(t)
+    for titles in artist_map.values():
+        titles.sort()
+    return artist_map
+
+
+def build_trigram_map(keys) -> dict:
+    """
+    Inverted index: title trigram -> ascending positions (in `keys` order) of
+    the "artist|title" keys whose title contains it. Approximate matching
+    looks up a recommendation's rarest title trigrams here, so it only ever
+    scores keys that share some of them, whoever the artist is.
+
+    The JSON index stores these ids against its text_map key order, which
+    keeps the postings a fraction of the size of repeating every key;
+    TrigramPostings resolves them and trigram_keys() expands them for the
+    binary index.
+    """
+    trigram_map = {}
+    for i, k in enumerate(keys):
+        _, sep, t = k.partition("|")
+        if sep and t:
+            for g in trigrams(t):
+                trigram_map.setdefault(g, []).append(i)
+    # trigrams() is a set: sort so the written index does not depend on
+    # string hash order.
+    return dict(sorted(trigram_map.items()))
+
+
+def trigram_keys(trigram_map: dict, keys) -> dict:
+    """A build_trigram_map() result with ids replaced by sorted keys (binary index form)."""
+    keys = list(keys)
+    return {g: sorted(keys[i] for i in ids) for g, ids in trigram_map.items()}
+
+
+# Per-file tag record fields kept in index "files" entries, in the order a
+# tag_map row stores them: artist, title, album, genre, duration (seconds).
+TAG_FIELDS = ("a", "t", "al", "g", "d")
+
+
+def tag_row(rec: dict) -> list:
+    return [str(rec.get(f, "")) for f in TAG_FIELDS]
+
+
+def build_tag_map(files: dict) -> dict:
+    """file -> tag_row for the binary index."""
+    return {f: tag_row(rec) for f, rec in files.items() if rec.get("a") or rec.get("t")}
+
+
+class FileTags(Mapping):
+    """file -> tag_row view over a JSON index's "files" records."""
+
+    def __init__(self, files: dict):
+        self._files = files
+
+    def __getitem__(self, f):
+        rec = self._files[f]
+        if not (rec.get("a") or rec.get("t")):
+            raise KeyError(f)
+        return tag_row(rec)
+
+    def __iter__(self):
+        return iter(self._files)
+
+    def __len__(self):
+        return len(self._files)
+
+    def __bool__(self):
+        return bool(self._files)
+
+
+class LazySection(Mapping):
+    """A JSON index section kept as raw bytes and decoded on first access."""
+
+    def __init__(self, raw: bytes):
+        self._raw = raw
+        self._data = None
+
+    def _get(self) -> dict:
+        if self._data is None:
+            self._data = json.loads(bytes(self._raw))
+            self._raw = None
+        return self._data
+
+    def __getitem__(self, k):
+        return self._get()[k]
+
+    def get(self, k, default=None):
+        return self._get().get(k, default)
+
+    def __contains__(self, k):
+        return k in self._get()
+
+    def __iter__(self):
+        return iter(self._get())
+
+    def __len__(self):
+        return len(self._get())
+
+    def __bool__(self):
+        # Checked on every load; answer it without decoding.
+        if self._data is not None:
+            return bool(self._data)
+        return bytes(self._raw[:2]) != b"{}"
+
+
+class TrigramPostings(Mapping):
+    """
+    trigram -> ["artist|title" keys] view over a JSON index's id postings.
+    The id -> key list (text_map order) is built on first use. count(),
+    refs() and ref_str() mirror BinaryMap, so approximate matching tallies
+    shared ids and only resolves the few keys it scores.
+    """
+
+    def __init__(self, postings: dict, text_map: dict):
+        self._postings = postings
+        self._text_map = text_map
+        self._keys = None
+
+    def _key_list(self) -> list:
+        if self._keys is None:
+            self._keys = list(self._text_map)
+        return self._keys
+
+    def __getitem__(self, g):
+        keys = self._key_list()
+        return [keys[i] for i in self._postings[g]]
+
+    def count(self, g: str) -> int:
+        return len(self._postings.get(g) or ())
+
+    def refs(self, g: str) -> list:
+        return self._postings.get(g) or []
+
+    def ref_str(self, ref: int) -> str:
+        return self._key_list()[ref]
+
+    def __contains__(self, g):
+        return g in self._postings
+
+    def __iter__(self):
+        return iter(self._postings)
+
+    def __len__(self):
+        return len(self._postings)
+
+    def __bool__(self):
+        return bool(self._postings)
+
+
+def content_hasher():
+    """Hasher for the header "hash": fed the serialized data sections (not header/meta)."""
+    return hashlib.blake2b(digest_size=16)
+
+
+def json_header_block(header: dict) -> str:
+    """The fixed-size leading '{"header": {...}' block of a JSON index."""
+    block = JSON_HEADER_PREFIX.decode("ascii") + json.dumps(header, ensure_ascii=True)
+    if len(block) > JSON_HEADER_BYTES:
+        raise ValueError(f"index header exceeds {JSON_HEADER_BYTES} bytes")
+    return block.ljust(JSON_HEADER_BYTES)
+
+
+def read_header(path: str):
+    """
+    Return the index header dict, or None for an index without one (built
+    before headers existed) or a file that is not an index. Reads only the
+    first few hundred bytes.
+    """
+    try:
+        with open(path, "rb") as f:
+            head = f.read(max(JSON_HEADER_BYTES, HEADER.size))
+    except OSError:
+        return None
+    if head.startswith(BIN_MAGIC):
+        if len(head) < HEADER.size:
+            return None
+        magic, version, _, _, _, _, schema, _, files, db_update, digest, builder = HEADER.unpack_from(head, 0)
+        if version != BIN_VERSION:
+            return None
+        return {
+            "schema": schema,
+            "builder": builder.rstrip(b"\0").decode("ascii", "replace"),
+            "db_update": str(db_update) if db_update else "",
+            "files": files,
+            "hash": digest.hex(),
+        }
+    if head.startswith(JSON_HEADER_PREFIX):
+        try:
+            return json.loads(head[len(JSON_HEADER_PREFIX):JSON_HEADER_BYTES].decode("ascii"))
+        except ValueError:
+            return None
+    return None
+
+
+def check_header(header) -> str:
+    """Return why an index can't be used ("" when it can). No header = legacy, allowed."""
+    if header is None:
+        return ""
+    if header.get("schema") != INDEX_SCHEMA:
+        return (f"index schema {header.get('schema')} (builder {header.get('builder') or '?'}), "
+                f"expected {INDEX_SCHEMA}; rebuild with build_moode_index.py --full")
+    return ""
+
+
+def binary_path_for(index_path: str) -> str:
+    root, ext = os.path.splitext(index_path)
+    return (root if ext == ".json" else index_path) + ".bin"
+
+
+def write_binary_index(path: str, maps: dict, header: dict = None):
+    """
+    Write {table_name: {key: [paths]}} atomically to `path`. `header` is the
+    JSON index's header, so both files carry the same content hash.
+    """
+    header = header or {}
+    pool = bytearray()
+    interned = {}
+
+    def intern(s: str):
+        ref = interned.get(s)
+        if ref is None:
+            b = s.encode("utf-8")
+            ref = (len(pool), len(b))
+            pool.extend(b)
+            interned[s] = ref
+        return ref
+
+    tables = []
+    for name, m in maps.items():
+        keys = sorted(m, key=lambda k: k.encode("utf-8"))
+        key_rows = bytearray()
+        path_rows = bytearray()
+        n_paths = 0
+        for k in keys:
+            paths = m[k] or []
+            k_off, k_len = intern(k)
+            key_rows += KEY.pack(k_off, k_len, n_paths, len(paths))
+            for p in paths:
+                path_rows += PATH.pack(*intern(p))
+            n_paths += len(paths)
+        tables.append((name, len(keys), key_rows, n_paths, path_rows))
+
+    off = HEADER.size + TABLE.size * len(tables)
+    dir_rows = bytearray()
+    body = bytearray()
+    for name, n_keys, key_rows, n_paths, path_rows in tables:
+        keys_off = off + len(body)
+        body += key_rows
+        paths_off = off + len(body)
+        body += path_rows
+        dir_rows += TABLE.pack(name.encode("utf-8")[:16], n_keys, keys_off, n_paths, paths_off)
+    pool_off = off + len(body)
+
+    tmp = path + ".tmp"
+    with open(tmp, "wb") as f:
+        f.write(HEADER.pack(
+            BIN_MAGIC, BIN_VERSION, len(tables), 0, pool_off, len(pool),
+            int(header.get("schema") or INDEX_SCHEMA), 0,
+            int(header.get("files") or 0),
+            int(header.get("db_update") or 0),
+            bytes.fromhex(header.get("hash") or "").ljust(16, b"\0")[:16],
+            str(header.get("builder") or "").encode("ascii", "replace")[:16],
+        ))
+        f.write(dir_rows)
+        f.write(body)
+        f.write(pool)
+    os.replace(tmp, path)
+
+
+class BinaryMap(Mapping):
+    """Read-only key -> [paths] view over one table of an mmapped index."""
+
+    def __init__(self, mm, n_keys: int, keys_off: int, paths_off: int, pool_off: int):
+        self._mm = mm
+        self._n = n_keys
+        self._keys_off = keys_off
+        self._paths_off = paths_off
+        self._pool_off = pool_off
+
+    def _str(self, off: int, length: int) -> bytes:
+        start = self._pool_off + off
+        return self._mm[start:start + length]
+
+    def _row(self, i: int):
+        return KEY.unpack_from(self._mm, self._keys_off + i * KEY.size)
+
+    def _key_at(self, i: int) -> bytes:
+        k_off, k_len, _, _ = self._row(i)
+        return self._str(k_off, k_len)
+
+    def _paths_at(self, i: int) -> list:
+        _, _, start, count = self._row(i)
+        out = []
+        for j in range(start, start + count):
+            p_off, p_len = PATH.unpack_from(self._mm, self._paths_off + j * PATH.size)
+            out.append(self._str(p_off, p_len).decode("utf-8"))
+        return out
+
+    def _find(self, key: str) -> int:
+        target = key.encode("utf-8")
+        lo, hi = 0, self._n
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._key_at(mid) < target:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo < self._n and self._key_at(lo) == target:
+            return lo
+        return -1
+
+    def __getitem__(self, key):
+        if not isinstance(key, str):
+            raise KeyError(key)
+        i = self._find(key)
+        if i < 0:
+            raise KeyError(key)
+        return self._paths_at(i)
+
+    def count(self, key: str) -> int:
+        """len(self[key]) without decoding the paths; 0 when absent."""
+        i = self._find(key) if isinstance(key, str) else -1
+        return self._row(i)[3] if i >= 0 else 0
+
+    def refs(self, key: str) -> list:
+        """Undecoded (pool offset, length) refs of self[key]; ref_str() decodes one."""
+        i = self._find(key) if isinstance(key, str) else -1
+        if i < 0:
+            return []
+        _, _, start, count = self._row(i)
+        base = self._paths_off + start * PATH.size
+        return list(PATH.iter_unpack(self._mm[base:base + count * PATH.size]))
+
+    def ref_str(self, ref) -> str:
+        return self._str(*ref).decode("utf-8")
+
+    def __contains__(self, key):
+        return isinstance(key, str) and self._find(key) >= 0
+
+    def __iter__(self):
+        for i in range(self._n):
+            yield self._key_at(i).decode("utf-8")
+
+    def items(self):
+        for i in range(self._n):
+            yield self._key_at(i).decode("utf-8"), self._paths_at(i)
+
+    def values(self):
+        for i in range(self._n):
+            yield self._paths_at(i)
+
+    def __len__(self):
+        return self._n
+
+
+class BinaryIndex:
+    """An open, mmapped binary index. Keep it alive while its maps are in use."""
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, "rb") as f:
+            self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, version, n_tables, _, pool_off, _, _, _, _, _, _, _ = HEADER.unpack_from(self._mm, 0)
+        if magic != BIN_MAGIC or version != BIN_VERSION:
+            self._mm.close()
+            raise ValueError(f"not a v{BIN_VERSION} binary index: {path}")
+        self.maps = {}
+        for t in range(n_tables):
+            name, n_keys, keys_off, _, paths_off = TABLE.unpack_from(self._mm, HEADER.size + t * TABLE.size)
+            name = name.rstrip(b"\0").decode("utf-8")
+            self.maps[name] = BinaryMap(self._mm, n_keys, keys_off, paths_off, pool_off)
+
+    def get(self, name: str):
+        return self.maps.get(name) or {}
+
+    def close(self):
+        self.maps = {}
+        self._mm.close()
+
+
+INDEX_MAPS = ("text_map", "mbid_map", "artist_map", "tag_map", "trigram_map")
+
+
+def _maps_from(source: str, get, header=None, binary=None) -> dict:
+    out = {name: get(name) or {} for name in INDEX_MAPS}
+    if not out["artist_map"] and out["text_map"]:
+        # Index predates artist_map: build it once here rather than letting
+        # every fuzzy lookup scan the whole text_map.
+        out["artist_map"] = build_artist_map(out["text_map"])
+    if not out["tag_map"] and get("files"):
+        # JSON keeps tags in the per-file records; view them in place.
+        out["tag_map"] = FileTags(get("files"))
+    out["source"] = source
+    out["header"] = header
+    out["binary"] = binary
+    return out
+
+
+def close_index(lib: dict):
+    """Release the mmap behind a load_index() result; its maps are unusable afterwards."""
+    binary = lib.get("binary")
+    if binary is not None:
+        lib["binary"] = None
+        binary.close()
+
+
+def _parse_json_index(raw: bytes, spans: dict) -> dict:
+    """json.loads(raw), with the sections at spans kept as LazySection."""
+    view = memoryview(raw)
+    parts, lazy, pos = [], {}, 0
+    for name, (start, end) in sorted(spans.items(), key=lambda kv: kv[1][0]):
+        if start < pos or raw[start:start + 1] != b"{" or raw[end - 1:end] != b"}":
+            return json.loads(raw)
+        parts += [view[pos:start], b"{}"]
+        lazy[name] = LazySection(view[start:end])
+        pos = end
+    parts.append(view[pos:])
+    idx = json.loads(b"".join(parts))
+    idx.update(lazy)
+    return idx
+
+
+def load_index(path: str) -> dict:
+    """
+    Load the lookup maps for a vibe run as {"text_map", "mbid_map",
+    "artist_map", "tag_map", "trigram_map", "source", "header", "binary"}.
+    tag_map rows are tag_row() lists; "binary" is the open BinaryIndex (or
+    None for JSON) that close_index() releases.
+
+    The header is checked first; an index with another schema raises
+    ValueError without being loaded. A .bin path is mmapped. For a .json
+    path, a sibling .bin with the same content hash is preferred (for
+    header-less indexes: one at least as new as the JSON); otherwise the
+    JSON is parsed.
+    """
+    header = read_header(path)
+    err = check_header(header)
+    if err:
+        raise ValueError(err)
+    if path.endswith(".bin"):
+        binary = BinaryIndex(path)
+        return _maps_from(path, binary.get, header, binary)
+
+    bin_path = binary_path_for(path)
+    try:
+        bin_header = read_header(bin_path)
+        if header is not None:
+            use_bin = bool(bin_header) and bin_header.get("hash") == header.get("hash")
+        else:
+            use_bin = os.path.getmtime(bin_path) >= os.path.getmtime(path)
+        if use_bin:
+            binary = BinaryIndex(bin_path)
+            return _maps_from(bin_path, binary.get, bin_header, binary)
+    except (OSError, ValueError, struct.error):
+        pass
+
+    with open(path, "rb") as f:
+        raw = f.read()
+    idx = _parse_json_index(raw, (header or {}).get("lazy") or {})
+    out = _maps_from(path, idx.get, header)
+    if out["trigram_map"]:
+        out["trigram_map"] = TrigramPostings(out["trigram_map"], out["text_map"])
+    return out
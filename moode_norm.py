@@ -0,0 +1,57 @@
+"""
+Text normalization shared by build_moode_index.py and lastfm_vibe_radio.py.
+
+Index keys are "norm(artist)|norm(title)", so both sides must normalize
+identically; keep this the only copy of norm().
+"""
+import re
+from functools import lru_cache
+
+TITLE_JUNK = [
+    "album version", "single version", "radio edit", "edit",
+    "remaster", "remastered", "live", "live album version",
+    "mono", "stereo", "bonus track", "deluxe edition", "expanded edition",
+]
+
+NORM_CACHE_SIZE = 16384
+
+_PAREN_RE = re.compile(r"\s*\(.*?\)\s*")
+_BRACKET_RE = re.compile(r"\s*\[.*?\]\s*")
+_FEAT_RE = re.compile(r"\b(feat|ft)\.?\b.*$")
+_NON_ALNUM_RE = re.compile(r"[^a-z0-9]+")
+
+# One scan tells us whether any junk phrase is present. Removal itself must
+# stay ordered str.replace calls: a leftmost-match alternation differs on
+# overlaps (e.g. "livedit": "edit" is removed before "live" is seen).
+_JUNK_RE = re.compile("|".join(re.escape(j) for j in TITLE_JUNK))
+
+
+@lru_cache(maxsize=NORM_CACHE_SIZE)
+def norm(s: str) -> str:
+    if not s:
+        return ""
+    s = s.casefold().strip()
+    s = _PAREN_RE.sub(" ", s)
+    s = _BRACKET_RE.sub(" ", s)
+    s = _FEAT_RE.sub("", s)
+    if _JUNK_RE.search(s):
+        for junk in TITLE_JUNK:
+            s = s.replace(junk, " ")
+    # Runs of non-alphanumerics (spaces included) collapse to one space here,
+    # so no separate whitespace squeeze is needed.
+    return _NON_ALNUM_RE.sub(" ", s).strip()
+
+
+def trigrams(s: str) -> set:
+    """Character trigrams of a normalized string, space-padded so word edges count."""
+    if not s:
+        return set()
+    s = f" {s} "
+    return {s[i:i + 3] for i in range(len(s) - 2)}
+
+
+def dice(a: set, b: set) -> float:
+    """Dice coefficient of two trigram sets (1.0 = identical)."""
+    if not a or not b:
+        return 0.0
+    return 2.0 * len(a & b) / (len(a) + len(b))
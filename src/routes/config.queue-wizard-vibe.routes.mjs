@@ -1,5 +1,8 @@
 import fs from 'node:fs/promises';
 import path from 'node:path';
+import net from 'node:net';
+import { EventEmitter } from 'node:events';
+import { PassThrough } from 'node:stream';
 import { execFile, spawn } from 'node:child_process';
 import { promisify } from 'node:util';
 import { MPD_HOST } from '../config.mjs';
@@ -10,6 +13,133 @@ function makeVibeJobId() {
   return `vibe-${Date.now()}-${Math.random().toString(36).slice(2, 10)}`;
 }
 
+// Run lastfm_vibe_radio.py. When VIBE_WORKER_SOCKET points at a resident
+// worker (`lastfm_vibe_radio.py --serve <sock>`) the job is sent there, which
+// skips interpreter start-up and reuses its loaded index / MPD / Last.fm
+// connections; otherwise (or if the socket is not answering) spawn python3.
+// Either way the caller gets a ChildProcess-like object: stdout/stderr streams,
+// 'close' (code) and 'error' events, kill(). useWorker: false always spawns.
+function runVibePy(pyPath, pyArgs, { useWorker = true } = {}) {
+  const sockPath = useWorker ? String(process.env.VIBE_WORKER_SOCKET || '').trim() : '';
+  const spawnLocal = () => spawn('python3', [pyPath, ...pyArgs], { stdio: ['ignore', 'pipe', 'pipe'] });
+  if (!sockPath) return spawnLocal();
+
+  const proc = new EventEmitter();
+  proc.stdout = new PassThrough();
+  proc.stderr = new PassThrough();
+  proc.pid = undefined;
+  let child = null;
+  let sock = null;
+  let connected = false;
+  let closed = false;
+  const finish = (code) => {
+    if (closed) return;
+    closed = true;
+    proc.stdout.end();
+    proc.stderr.end();
+    proc.emit('close', code);
+  };
+  proc.kill = (signal = 'SIGTERM') => {
+    // Dropping the connection cancels a served job at its next output line.
+    if (child) return child.kill(signal);
+    if (sock) sock.destroy();
+    finish(null);
+    return true;
+  };
+
+  sock = net.createConnection(sockPath);
+  sock.on('connect', () => {
+    connected = true;
+    sock.write(`${JSON.stringify({ argv: pyArgs })}\n`);
+  });
+  let buf = '';
+  sock.on('data', (chunk) => {
+    buf += String(chunk || '');
+    const lines = buf.split('\n');
+    buf = lines.pop() || '';
+    for (const ln of lines) {
+      if (!ln) continue;
+      let msg;
+      try { msg = JSON.parse(ln); } catch { continue; }
+      if (typeof msg.line === 'string') proc.stdout.write(`${msg.line}\n`);
+      if ('exit' in msg) {
+        sock.end();
+        finish(Number(msg.exit) || 0);
+      }
+    }
+  });
+  sock.on('error', (e) => {
+    if (connected) {
+      proc.stderr.write(`vibe worker connection failed: ${e?.message || e}\n`);
+      finish(1);
+      return;
+    }
+    // Worker not running: fall back to a one-off process.
+    child = spawnLocal();
+    proc.pid = child.pid;
+    child.stdout.pipe(proc.stdout);
+    child.stderr.pipe(proc.stderr);
+    child.on('error', (err) => proc.emit('error', err));
+    child.on('close', (code) => { closed = true; proc.emit('close', code); });
+  });
+  sock.on('close', () => { if (connected) finish(1); });
+  return proc;
+}
+
+// execFileP equivalent for runVibePy; rejects on a nonzero exit. Used by the
+// preview / dry-run routes, which spawn their own process: the worker runs
+// one job at a time, so a preview sent there would wait behind a queue build.
+function runVibePyP(pyPath, pyArgs) {
+  return new Promise((resolve, reject) => {
+    const proc = runVibePy(pyPath, pyArgs, { useWorker: false });
+    let stdout = '';
+    let stderr = '';
+    proc.stdout.on('data', (b) => { stdout += String(b || ''); });
+    proc.stderr.on('data', (b) => { stderr += String(b || ''); });
+    proc.on('error', reject);
+    proc.on('close', (code) => {
+      if (code === 0) return resolve({ stdout, stderr });
+      const tail = (stderr || stdout).trim().split('\n').slice(-5).join('\n');
+      reject(new Error(`lastfm_vibe_radio.py exited with ${code}${tail ? `: ${tail}` : ''}`));
+    });
+  });
+}
+
+// --progress-json events from lastfm_vibe_radio.py ({"event": ...} lines on
+// stdout). Returns false for ordinary log lines.
+function applyVibeEvent(job, line) {
+  if (!line.startsWith('{"event"')) return false;
+  let ev;
+  try { ev = JSON.parse(line); } catch { return false; }
+  job.liveEvents = true;
+  if (ev.event === 'track') {
+    job.added.push({
+      eventId: job.nextEventId++,
+      artist: String(ev.artist || ''),
+      title: String(ev.title || ''),
+      album: String(ev.album || ''),
+      file: String(ev.file || ''),
+      method: String(ev.method || ''),
+    });
+    if (job.added.length > 500) job.added = job.added.slice(-500);
+    job.builtCount += 1;
+    job.phase = job.playingAt ? 'playing, adding tracks' : 'adding tracks';
+  } else if (ev.event === 'drop') {
+    // The track was announced before its batch reached MPD; take it back.
+    const file = String(ev.file || '');
+    const at = job.added.map((x) => x.file).lastIndexOf(file);
+    if (at >= 0) job.added.splice(at, 1);
+    job.builtCount = Math.max(0, job.builtCount - 1);
+    job.logs.push(`dropped (MPD can't add): ${file}`);
+  } else if (ev.event === 'playing') {
+    job.playingAt = Date.now();
+    job.phase = 'playing, adding tracks';
+  } else if (ev.event === 'done') {
+    job.deadlineHit = !!ev.deadline_hit;
+  }
+  return true;
+}
+
 export function registerConfigQueueWizardVibeRoutes(app, deps) {
   const { requireTrackKey, getRatingForFile } = deps;
   const vibeJobs = new Map();
@@ -55,13 +185,39 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
     } catch {}
   }
 
+  // Must match INDEX_SCHEMA in moode_index.py.
+  const VIBE_INDEX_SCHEMA = 5;
+  const VIBE_INDEX_HEADER_BYTES = 512;
+
+  // The index starts with a fixed-size '{"header": {...}' block; read just that.
+  async function readVibeIndexHeader(vibeIndexPath) {
+    let fh;
+    try {
+      fh = await fs.open(vibeIndexPath, 'r');
+      const buf = Buffer.alloc(VIBE_INDEX_HEADER_BYTES);
+      const { bytesRead } = await fh.read(buf, 0, buf.length, 0);
+      const head = buf.toString('ascii', 0, bytesRead);
+      const prefix = '{"header": ';
+      if (!head.startsWith(prefix)) return null;
+      const hdr = JSON.parse(head.slice(prefix.length).trim());
+      return hdr && typeof hdr === 'object' ? hdr : null;
+    } catch {
+      return null;
+    } finally {
+      await fh?.close().catch(() => {});
+    }
+  }
+
   async function ensureVibeIndexReady(job, vibeIndexPath, mpdHost) {
-    const staleMs = Number(process.env.VIBE_INDEX_MAX_AGE_MS || 12 * 60 * 60 * 1000);
+    // build_moode_index.py is incremental (no-op when MPD db_update is unchanged),
+    // so the index can be refreshed often.
+    const staleMs = Number(process.env.VIBE_INDEX_MAX_AGE_MS || 30 * 60 * 1000);
     let needsBuild = false;
     try {
       const st = await fs.stat(vibeIndexPath);
       const ageMs = Date.now() - Number(st.mtimeMs || 0);
-      if (!Number.isFinite(st.size) || st.size < 256 || ageMs > staleMs) needsBuild = true;
+      const hdr = await readVibeIndexHeader(vibeIndexPath);
+      if (!hdr || Number(hdr.schema) !== VIBE_INDEX_SCHEMA || ageMs > staleMs) needsBuild = true;
     } catch {
       needsBuild = true;
     }
@@ -73,23 +229,71 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
     job.logs.push(`[index] building local index: ${vibeIndexPath}`);
     appendVibeJobLog(job, 'index-build-start', { vibeIndexPath, mpdHost, buildPy }).catch(() => {});
 
-    try {
-      const { stdout, stderr } = await execFileP('python3', [buildPy], {
-        env: {
-          ...process.env,
-          INDEX_PATH: vibeIndexPath,
-          MPD_HOST: String(mpdHost || 'moode.local'),
-          MPD_PORT: '6600',
-        },
-      });
-      const out = String(stdout || '').trim();
-      const err = String(stderr || '').trim();
-      if (out) {
-        out.split(/\r?\n/).forEach((ln) => { if (ln) job.logs.push(`[index] ${ln}`); });
+    const stallMs = Number(process.env.VIBE_INDEX_STALL_MS || 120 * 1000);
+    const onIndexLine = (ln) => {
+      if (!ln) return;
+      let ev = null;
+      if (ln.startsWith('{')) {
+        try { ev = JSON.parse(ln); } catch {}
       }
-      if (err) {
-        err.split(/\r?\n/).forEach((ln) => { if (ln) job.logs.push(`[index][stderr] ${ln}`); });
+      if (!ev) {
+        job.logs.push(`[index] ${ln}`);
+        return;
       }
+      if (ev.event === 'progress') {
+        const eta = Number(ev.eta_s) > 0 ? `, ~${Math.ceil(Number(ev.eta_s))}s left` : '';
+        const of = Number(ev.expected) > 0 ? `/${ev.expected}` : '';
+        job.phase = `creating index file please wait (${ev.files}${of} files${eta})`;
+      } else if (ev.event === 'phase') {
+        job.logs.push(`[index] phase ${ev.phase}`);
+      } else if (ev.event === 'done') {
+        job.logs.push(`[index] done (${ev.build}) timings ${JSON.stringify(ev.timings || {})}`);
+        appendVibeJobLog(job, 'index-build-timings', ev).catch(() => {});
+      }
+      job.updatedAt = Date.now();
+    };
+
+    try {
+      await new Promise((resolve, reject) => {
+        const child = spawn('python3', [buildPy, '--progress-json'], {
+          stdio: ['ignore', 'pipe', 'pipe'],
+          env: {
+            ...process.env,
+            INDEX_PATH: vibeIndexPath,
+            MPD_HOST: String(mpdHost || 'moode.local'),
+            MPD_PORT: '6600',
+          },
+        });
+        let lastOutputAt = Date.now();
+        let stalled = false;
+        const stallTimer = setInterval(() => {
+          if (Date.now() - lastOutputAt < stallMs) return;
+          stalled = true;
+          try { child.kill('SIGTERM'); } catch (_) {}
+        }, 5000);
+
+        const pipeLines = (stream, onLine) => {
+          let buf = '';
+          stream.on('data', (chunk) => {
+            lastOutputAt = Date.now();
+            buf += String(chunk || '');
+            const lines = buf.split(/\r?\n/);
+            buf = lines.pop() || '';
+            lines.forEach((ln) => onLine(ln.trim()));
+          });
+          stream.on('end', () => { if (buf.trim()) onLine(buf.trim()); });
+        };
+        pipeLines(child.stdout, onIndexLine);
+        pipeLines(child.stderr, (ln) => { if (ln) job.logs.push(`[index][stderr] ${ln}`); });
+
+        child.on('error', (e) => { clearInterval(stallTimer); reject(e); });
+        child.on('close', (code) => {
+          clearInterval(stallTimer);
+          if (stalled) reject(new Error(`index build stalled (no output for ${Math.round(stallMs / 1000)}s)`));
+          else if (code !== 0) reject(new Error(`index build exited with code ${code}`));
+          else resolve();
+        });
+      });
       appendVibeJobLog(job, 'index-build-complete', { ok: true }).catch(() => {});
       return true;
     } catch (e) {
@@ -155,7 +359,9 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
         '--port', '6600',
         '--debug-trace',
         '--simple-seed-pass',
+        '--progress-json',
       ];
+      if (playNow) pyArgs.push('--start-after', String(process.env.VIBE_START_AFTER || '3'));
       if (excludeGenre === 'christmas') pyArgs.push('--exclude-christmas');
       else if (excludeGenre === 'none') pyArgs.push('--include-christmas');
       if (!playNow) {
@@ -222,9 +428,7 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
         return res.status(500).json({ ok: false, error: job.error || 'Index build failed', jobId });
       }
 
-      const child = spawn('python3', [pyPath, ...pyArgs], {
-        stdio: ['ignore', 'pipe', 'pipe'],
-      });
+      const child = runVibePy(pyPath, pyArgs);
       job.proc = child;
       appendVibeJobLog(job, 'run', {
         seedArtist: artist,
@@ -243,6 +447,10 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
         const line = String(lineIn || '').trim();
         if (!line) return;
         job.updatedAt = Date.now();
+        if (applyVibeEvent(job, line)) {
+          appendVibeJobLog(job, 'event', { line }).catch(() => {});
+          return;
+        }
         job.logs.push(line);
         if (job.logs.length > 300) job.logs.shift();
         appendVibeJobLog(job, 'line', { line }).catch(() => {});
@@ -252,7 +460,7 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
 
         const m = line.match(/^\[hop\s+\d+\]\s+Added:\s+(.+?)\s+\(([^)]+)\)/i)
           || line.match(/^\[simple\]\s+Added:\s+(.+?)\s+\(([^)]+)\)/i);
-        if (m) {
+        if (m && !job.liveEvents) {
           const label = String(m[1] || '').trim();
           const method = String(m[2] || '').trim();
           const parts = label.split(' — ');
@@ -303,6 +511,7 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
           const data = JSON.parse(jsonOut);
           const baseTracks = Array.isArray(data?.tracks) ? data.tracks : [];
           job.rawBuiltCount = baseTracks.length;
+          job.deadlineHit = !!data?.deadline_hit;
 
           if (job.minRating > 0 && typeof getRatingForFile === 'function') {
             const kept = [];
@@ -422,6 +631,8 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
         minRating: Number(job.minRating || 0),
         builtCount: Number(job.builtCount || 0),
         rawBuiltCount: Number(job.rawBuiltCount || 0),
+        playing: !!job.playingAt,
+        deadlineHit: !!job.deadlineHit,
         seedArtist: job.seedArtist,
         seedTitle: job.seedTitle,
         excludeGenre: String(job.excludeGenre || ''),
@@ -483,8 +694,8 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
       const job = vibeJobs.get(jobId);
       if (!job) return res.status(404).json({ ok: false, error: 'Unknown vibe job' });
 
-      if (!job.done && job.proc?.pid) {
-        try { process.kill(job.proc.pid, 'SIGTERM'); } catch (_) {}
+      if (!job.done && job.proc) {
+        try { job.proc.kill('SIGTERM'); } catch (_) {}
       }
 
       job.done = true;
@@ -515,7 +726,7 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
       const pyPath = path.resolve(process.cwd(), 'lastfm_vibe_radio.py');
       const jsonTmp = `/tmp/vibe-np-${Date.now()}-${process.pid}.json`;
       const vibeIndexPath = await resolveVibeIndexPath();
-      await execFileP('python3', [pyPath, '--api-key', lastfmApiKey, '--index', vibeIndexPath, '--seed-artist', artist, '--seed-title', title, '--target-queue', String(targetQueue), '--json-out', jsonTmp, '--mode', 'load', '--host', mpdHost, '--port', '6600', '--dry-run', '--debug-trace']);
+      await runVibePyP(pyPath, ['--api-key', lastfmApiKey, '--index', vibeIndexPath, '--seed-artist', artist, '--seed-title', title, '--target-queue', String(targetQueue), '--json-out', jsonTmp, '--mode', 'load', '--host', mpdHost, '--port', '6600', '--dry-run', '--debug-trace']);
       const data = JSON.parse(await fs.readFile(jsonTmp, 'utf8'));
       await fs.unlink(jsonTmp).catch(() => {});
       return res.json({ ok: true, tracks: data?.tracks || [], summary: data, targetQueue, seedArtist: artist, seedTitle: title });
@@ -538,7 +749,7 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
       const pyPath = path.resolve(process.cwd(), 'lastfm_vibe_radio.py');
       const jsonTmp = `/tmp/vibe-np-${Date.now()}-${process.pid}.json`;
       const vibeIndexPath = await resolveVibeIndexPath();
-      await execFileP('python3', [pyPath, '--api-key', lastfmApiKey, '--index', vibeIndexPath, '--seed-artist', artist, '--seed-title', title, '--target-queue', String(targetQueue), '--json-out', jsonTmp, '--mode', 'load', '--host', mpdHost, '--port', '6600', '--dry-run', '--debug-trace']);
+      await runVibePyP(pyPath, ['--api-key', lastfmApiKey, '--index', vibeIndexPath, '--seed-artist', artist, '--seed-title', title, '--target-queue', String(targetQueue), '--json-out', jsonTmp, '--mode', 'load', '--host', mpdHost, '--port', '6600', '--dry-run', '--debug-trace']);
       const data = JSON.parse(await fs.readFile(jsonTmp, 'utf8'));
       await fs.unlink(jsonTmp).catch(() => {});
       return res.json({ ok: true, tracks: data?.tracks || [], summary: data, targetQueue, seedArtist: artist, seedTitle: title });
@@ -638,7 +849,9 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
         '--port', '6600',
         '--debug-trace',
         '--simple-seed-pass',
+        '--progress-json',
       ];
+      if (playNow) pyArgs.push('--start-after', String(process.env.VIBE_START_AFTER || '3'));
       if (playNow || keepPlaying) {
         pyArgs.push('--crop');
       }
@@ -646,10 +859,7 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
         pyArgs.push('--no-final-stop');
       }
 
-      const child = spawn('python3', pyArgs, {
-        stdio: ['ignore', 'pipe', 'pipe'],
-        detached: false,
-      });
+      const child = runVibePy(pyArgs[0], pyArgs.slice(1));
       job.proc = child;
       appendVibeJobLog(job, 'run', {
         seedArtist,
@@ -667,6 +877,10 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
         const line = String(lineIn || '').trim();
         if (!line) return;
         job.updatedAt = Date.now();
+        if (applyVibeEvent(job, line)) {
+          appendVibeJobLog(job, 'event', { line }).catch(() => {});
+          return;
+        }
         job.logs.push(line);
         if (job.logs.length > 300) job.logs.shift();
         appendVibeJobLog(job, 'line', { line }).catch(() => {});
@@ -676,7 +890,7 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
 
         const m = line.match(/^\[hop\s+\d+\]\s+Added:\s+(.+?)\s+\(([^)]+)\)/i)
           || line.match(/^\[simple\]\s+Added:\s+(.+?)\s+\(([^)]+)\)/i);
-        if (m) {
+        if (m && !job.liveEvents) {
           const label = String(m[1] || '').trim();
           const method = String(m[2] || '').trim();
           const parts = label.split(' — ');
@@ -762,7 +976,7 @@ export function registerConfigQueueWizardVibeRoutes(app, deps) {
       const pyPath = path.resolve(process.cwd(), 'lastfm_vibe_radio.py');
       const jsonTmp = `/tmp/vibe-seed-${Date.now()}-${process.pid}.json`;
       const vibeIndexPath = await resolveVibeIndexPath();
-      await execFileP('python3', [pyPath, '--api-key', lastfmApiKey, '--index', vibeIndexPath, '--seed-artist', seedArtist, '--seed-title', seedTitle, '--target-queue', String(targetQueue), '--json-out', jsonTmp, '--mode', 'load', '--host', mpdHost, '--port', '6600', '--dry-run', '--debug-trace']);
+      await runVibePyP(pyPath, ['--api-key', lastfmApiKey, '--index', vibeIndexPath, '--seed-artist', seedArtist, '--seed-title', seedTitle, '--target-queue', String(targetQueue), '--json-out', jsonTmp, '--mode', 'load', '--host', mpdHost, '--port', '6600', '--dry-run', '--debug-trace']);
       const data = JSON.parse(await fs.readFile(jsonTmp, 'utf8'));
       await fs.unlink(jsonTmp).catch(() => {});
       return res.json({ ok: true, tracks: data?.tracks || [], summary: data, targetQueue, seedArtist, seedTitle });